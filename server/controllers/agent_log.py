@@ -0,0 +1,134 @@
+"""Leveled, rate-limited logging for the tracking agents.
+
+Records are handed to a queue and written by a listener thread, so
+collectors never block on the console or on disk. Every message template
+is rate limited per logger (``LOG_RATE_LIMIT`` records per
+``LOG_RATE_PERIOD`` seconds; the next record that gets through reports how
+many were suppressed). Per-event messages, such as one per packet or per
+history entry, are logged with ``extra=SAMPLED`` and only every
+``LOG_SAMPLE_EVERY``-th one is kept. ``LOG_FILE`` adds a JSON-lines sink
+rotated at ``LOG_FILE_MAX_BYTES``, keeping ``LOG_FILE_BACKUPS`` old files.
+
+    log = get_logger('usage')
+    log.info("Application %s (PID: %d) closed.", name, pid, extra={'pid': pid})
+    log.debug("Packet %s -> %s", src, dst, extra=SAMPLED)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+SAMPLED = {'sampled': True}
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through ``rate`` records per template every ``period`` seconds, and every ``sample_every``-th sampled one."""
+
+    def __init__(self, rate=10, period=60.0, sample_every=100):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self.sample_every = max(1, sample_every)
+        self._lock = threading.Lock()
+        self._windows = {}  # (logger, level, template) -> [window start, passed, suppressed]
+        self._samples = {}  # (logger, template) -> records seen
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        with self._lock:
+            if getattr(record, 'sampled', False):
+                seen = self._samples.get(key, 0)
+                self._samples[key] = seen + 1
+                if seen % self.sample_every:
+                    return False
+                record.sample_every = self.sample_every
+            if not self.rate:
+                return True
+            now = time.monotonic()
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The plain message, as the agents used to print it, plus a note on suppressed repeats."""
+
+    def format(self, record):
+        message = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            message += f" ({record.suppressed} similar messages suppressed)"
+        return message
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, including any ``extra`` fields."""
+
+    def format(self, record):
+        document = {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        document.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+def setup_logging():
+    """Configure the ``agent`` logger from ``LOG_*`` environment variables; safe to call twice."""
+    global _listener
+    logger = logging.getLogger('agent')
+    if _listener is not None:
+        return logger
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+    handlers = []
+    if os.getenv('LOG_CONSOLE', '1') == '1':
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(ConsoleFormatter())
+        handlers.append(console)
+    if os.getenv('LOG_FILE'):
+        sink = logging.handlers.RotatingFileHandler(
+            os.getenv('LOG_FILE'), maxBytes=int(os.getenv('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=int(os.getenv('LOG_FILE_BACKUPS', 5)), encoding='utf-8')
+        sink.setFormatter(JsonLinesFormatter())
+        handlers.append(sink)
+
+    # Bounded: under a flood, records are dropped rather than growing memory or blocking the caller
+    records = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter(rate=int(os.getenv('LOG_RATE_LIMIT', 10)),
+                                      period=float(os.getenv('LOG_RATE_PERIOD', 60)),
+                                      sample_every=int(os.getenv('LOG_SAMPLE_EVERY', 100))))
+    handler.handleError = lambda record: None  # queue.Full; the record is dropped
+    logger.addHandler(handler)
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
+
+
+def get_logger(name=None):
+    """A child of the ``agent`` logger; call ``setup_logging`` once at startup."""
+    return logging.getLogger(f'agent.{name}' if name else 'agent')
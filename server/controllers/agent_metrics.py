@@ -0,0 +1,220 @@
+"""Self-instrumentation for the tracking agents.
+
+Modules record into the shared ``metrics`` registry: counters, histograms
+(job durations, MongoDB write latency and batch sizes) and callback gauges
+read only when metrics are collected (queue depths, dropped packets, the
+agent's own RSS and CPU). The registry is exposed as Prometheus text on
+``127.0.0.1:METRICS_PORT/metrics`` and/or written every
+``METRICS_SUMMARY_INTERVAL`` seconds as a summary document to
+``agent_metrics_<mac>``.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (None if empty or above every bucket)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters, histograms and callback gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: Histogram}
+        self._callbacks = {}  # name -> {label key: (kind, func)}
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observe the duration of the ``with`` block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register(self, name, func, kind='gauge', **labels):
+        """Read ``func()`` whenever metrics are collected; ``kind`` is 'gauge' or 'counter'."""
+        with self._lock:
+            self._callbacks.setdefault(name, {})[_label_key(labels)] = (kind, func)
+
+    def _collect_callbacks(self):
+        with self._lock:
+            callbacks = {name: dict(series) for name, series in self._callbacks.items()}
+        values = {}
+        for name, series in callbacks.items():
+            for key, (kind, func) in series.items():
+                try:
+                    values.setdefault(name, (kind, {}))[1][key] = float(func())
+                except Exception as e:
+                    log.error("Metric %s failed: %s", name, e)
+        return values
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        callbacks = self._collect_callbacks()
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines += [f'{name}{_format_labels(key)} {value}' for key, value in series.items()]
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        for name, (kind, series) in sorted(callbacks.items()):
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [f'{name}{_format_labels(key)} {value}' for key, value in series.items()]
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """All metrics as one MongoDB document, with histograms reduced to count/sum/mean/p50/p95."""
+        callbacks = self._collect_callbacks()
+        entries = []
+        with self._lock:
+            for name, series in self._counters.items():
+                entries += [{'name': name, 'labels': dict(key), 'value': value} for key, value in series.items()]
+            for name, series in self._histograms.items():
+                for key, histogram in series.items():
+                    entries.append({
+                        'name': name, 'labels': dict(key), 'count': histogram.count, 'sum': histogram.sum,
+                        'mean': histogram.sum / histogram.count if histogram.count else None,
+                        'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95)
+                    })
+        for name, (kind, series) in callbacks.items():
+            entries += [{'name': name, 'labels': dict(key), 'value': value} for key, value in series.items()]
+        return {'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'metrics': entries}
+
+
+# Shared by every module of the agent
+metrics = MetricsRegistry()
+
+
+def collection_label(db_name, collection_name):
+    """``system_health_<mac>`` in database ``<mac>`` -> ``system_health``, keeping label values few."""
+    return collection_name.removesuffix(f'_{db_name}')
+
+
+def register_process_metrics(registry=metrics):
+    """RSS, CPU and thread count of the agent process itself."""
+    process = psutil.Process()
+    process.cpu_percent(interval=None)  # Prime; later reads cover the time since the previous one
+    registry.register('agent_process_resident_memory_bytes', lambda: process.memory_info().rss)
+    registry.register('agent_process_cpu_percent', lambda: process.cpu_percent(interval=None))
+    registry.register('agent_process_threads', process.num_threads)
+
+
+def serve_metrics(port, registry=metrics, host='127.0.0.1'):
+    """Serve ``registry`` as Prometheus text at ``http://host:port/metrics`` on a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Scrapes would otherwise print a line each
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_summary_reports(writer, collection, interval, registry=metrics):
+    """Queue a ``registry.snapshot()`` document for ``collection`` every ``interval`` seconds."""
+    def report():
+        next_run = time.monotonic() + interval
+        while True:
+            time.sleep(max(0.0, next_run - time.monotonic()))
+            next_run += interval
+            writer.put(collection, registry.snapshot())
+
+    threading.Thread(target=report, name='metrics-summary', daemon=True).start()
+
+
+def start_metrics_from_env(writer, collection):
+    """Start the outputs configured by ``METRICS_PORT`` and ``METRICS_SUMMARY_INTERVAL`` (0 disables)."""
+    register_process_metrics()
+    port = int(os.getenv('METRICS_PORT', 0))
+    if port:
+        serve_metrics(port)
+        log.info("Serving agent metrics on http://127.0.0.1:%d/metrics", port)
+    interval = float(os.getenv('METRICS_SUMMARY_INTERVAL', 60))
+    if interval > 0:
+        start_summary_reports(writer, collection, interval)
@@ -0,0 +1,188 @@
+"""asyncio runtime for the tracking agents (``AGENT_RUNTIME=async``).
+
+One event loop drives every collector:
+
+* Coroutine jobs run on the loop and use ``run_command`` (async subprocess)
+  and Motor instead of blocking calls.
+* Plain functions, mostly psutil-based collectors, are offloaded to a small
+  bounded executor. ``service`` jobs that never return, such as the scapy
+  capture, get a thread of their own.
+* The ``BufferedWriter`` queue is drained by a task writing through Motor.
+
+Jobs use the same schedule as ``scheduler.Scheduler``, computed by the same
+slot helpers: fixed-grid timing with jitter, no overlap, and ``timeout`` enforced by cancelling coroutine
+jobs. ``trigger(name)`` runs a job early, from any thread. SIGINT/SIGTERM
+cancel every task and flush the write queue before the loop exits.
+"""
+import asyncio
+import inspect
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_log import get_logger
+from agent_metrics import metrics
+from scheduler import first_slot, jittered, next_slot
+
+log = get_logger(__name__)
+
+
+async def run_command(*args, timeout=30):
+    """Run a command without blocking the loop; returns its stdout, or '' if it failed."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    except OSError as e:
+        log.error("Could not run %s: %s", args[0], e)
+        return ''
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        log.warning("%s timed out after %ss.", args[0], timeout)
+        return ''
+    return stdout.decode('utf-8', errors='replace')
+
+
+def motor_client(mongo_url):
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        raise ImportError("AGENT_RUNTIME=async needs Motor: pip install motor") from None
+    return AsyncIOMotorClient(mongo_url)
+
+
+class AsyncRuntime:
+    """Runs the agent's collectors, and flushes its write queue, on a single event loop."""
+
+    def __init__(self, schedule, writer, mongo_url, executor_workers=2):
+        self.schedule = schedule
+        self.writer = writer
+        self.executor_workers = executor_workers
+        self.mongo = motor_client(mongo_url)  # Shared with coroutine jobs; binds to the loop on first use
+        self._executor = None
+        self._tasks = []
+        self._loop = None
+        self._triggers = {}  # job name -> asyncio.Event set by trigger()
+
+    def trigger(self, name):
+        """Run interval job ``name`` now instead of at its next slot; safe from any thread."""
+        event = self._triggers.get(name)
+        if event is not None and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The loop already shut down
+
+    def run(self, functions):
+        """Run ``{job name: function or coroutine function}`` until SIGINT/SIGTERM."""
+        asyncio.run(self.main(functions))
+
+    async def main(self, functions):
+        loop = self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='offload')
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):  # Windows event loops
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+
+        self._tasks = [asyncio.create_task(self._flush_writes(), name='writer')]
+        for name, options in self.schedule['jobs'].items():
+            if not options.get('enabled', True) or name not in functions:
+                continue
+            if options.get('service'):
+                coroutine = self._service(name, functions[name], options.get('restart_delay', 30))
+            else:
+                coroutine = self._interval(name, functions[name], options)
+            self._tasks.append(asyncio.create_task(coroutine, name=name))
+
+        await stop.wait()
+        log.info("Shutting down: cancelling collectors and flushing pending writes.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._write_pending()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.mongo.close()
+
+    async def _interval(self, name, func, options):
+        interval = float(options.get('interval', 60))
+        jitter = float(options.get('jitter', 0))
+        timeout = options.get('timeout')
+        triggered = self._triggers[name] = asyncio.Event()
+        is_coroutine = inspect.iscoroutinefunction(func)
+        offloaded = None  # Executor run of a plain function; it cannot be cancelled once started
+        next_run = first_slot(time.monotonic(), jitter)
+        while True:
+            delay = max(0.0, jittered(next_run, jitter) - time.monotonic())
+            try:
+                # Several triggers during a run set the event once, so they coalesce into one more run
+                await asyncio.wait_for(triggered.wait(), delay)
+                early = True
+            except asyncio.TimeoutError:
+                early = False
+            triggered.clear()
+            if offloaded is not None and not offloaded.done():
+                metrics.inc('agent_job_skipped_total', job=name)  # Never overlap a job with itself
+            else:
+                started, status = time.monotonic(), 'ok'
+                try:
+                    if is_coroutine:
+                        await asyncio.wait_for(func(), timeout)  # Cancelled on timeout
+                    else:
+                        offloaded = self._executor.submit(func)
+                        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(offloaded)), timeout)
+                except asyncio.TimeoutError:
+                    status = 'timeout'
+                    log.warning("Job %s exceeded its %ss timeout.", name, timeout)
+                except Exception as e:
+                    status = 'failed'
+                    log.error("Job %s failed: %s", name, e)
+                metrics.observe('agent_job_duration_seconds', time.monotonic() - started, job=name)
+                metrics.inc('agent_job_runs_total', job=name, status=status)
+            if early:
+                continue  # A triggered run keeps the grid where it was
+            next_run, skipped = next_slot(next_run, interval, time.monotonic())
+            if skipped:
+                metrics.inc('agent_job_skipped_total', skipped, job=name)
+
+    async def _service(self, name, func, restart_delay):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Services block forever and can't be cancelled, so each runs on a daemon thread of its own
+            finished = loop.create_future()
+
+            def target():
+                try:
+                    func()
+                    outcome = None
+                except Exception as e:
+                    outcome = e
+                try:
+                    loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(outcome))
+                except RuntimeError:
+                    pass  # The loop already shut down
+
+            threading.Thread(target=target, name=name, daemon=True).start()
+            error = await finished
+            if error:
+                log.error("Service %s failed: %s; restarting in %ss.", name, error, restart_delay)
+            else:
+                log.warning("Service %s exited; restarting in %ss.", name, restart_delay)
+            await asyncio.sleep(restart_delay)
+
+    async def _flush_writes(self):
+        while True:
+            await asyncio.sleep(self.writer.flush_interval)
+            await self._write_pending()
+
+    async def _write_pending(self):
+        for key, items in self.writer.take().items():
+            collection = self.mongo[key[0]][key[1]]
+            for method, argument, guard in self.writer.operations(key, items):
+                with guard:
+                    await getattr(collection, method)(argument, ordered=False)
@@ -0,0 +1,238 @@
+"""Block-device inventory and hotplug monitor for the Linux agent.
+
+``scan_block_devices`` reads ``/sys/class/block``, the udev database in
+``/run/udev/data`` and ``/proc/self/mountinfo`` directly, with no
+``lsblk`` fork and no whitespace-split columns, so mount points with
+spaces survive. Every device carries stable identifiers (serial, vendor,
+model, filesystem UUID) when the system knows them.
+
+``BlockDeviceMonitor`` rescans only when the kernel reports a change: a
+block uevent on the netlink ``KOBJECT_UEVENT`` socket, or a change to the
+mount table, which ``poll()`` signals on ``/proc/self/mountinfo``. An
+idle machine costs nothing between events. Without netlink it falls back
+to rescanning every ``interval`` seconds. Subscribers receive the devices
+that were added and removed.
+"""
+import errno
+import glob
+import os
+import re
+import select
+import socket
+import threading
+import time
+
+from agent_log import get_logger
+
+log = get_logger('block_devices')
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_UEVENT_GROUP = 1
+
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _udev_properties(dev_number):
+    """``E:`` properties udev recorded for block device ``major:minor``."""
+    properties = {}
+    try:
+        with open(f'/run/udev/data/b{dev_number}') as f:
+            for line in f:
+                if line.startswith('E:') and '=' in line:
+                    key, value = line[2:].rstrip('\n').split('=', 1)
+                    properties[key] = value
+    except OSError:
+        pass
+    return properties
+
+
+def read_mounts(path='/proc/self/mountinfo'):
+    """``{'major:minor': (mount point, filesystem type)}``, first mount of each device."""
+    mounts = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                fields, _, tail = line.partition(' - ')
+                fields = fields.split(' ')
+                if len(fields) < 5:
+                    continue
+                # Spaces and other special characters in mount points are escaped as \ooo
+                mount_point = _OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), fields[4])
+                mounts.setdefault(fields[2], (mount_point, tail.split(' ')[0]))
+    except OSError:
+        pass
+    return mounts
+
+
+def _uuids_by_device():
+    uuids = {}
+    for link in glob.glob('/dev/disk/by-uuid/*'):
+        uuids[os.path.basename(os.path.realpath(link))] = os.path.basename(link)
+    return uuids
+
+
+def scan_block_devices():
+    """``{name: device}`` for every block device, each a dict of its identifiers, size and mount."""
+    mounts = read_mounts()
+    uuids = None  # Only read /dev/disk/by-uuid when udev has no UUID for a device
+    devices = {}
+    for entry in glob.glob('/sys/class/block/*'):
+        name = os.path.basename(entry)
+        if name.startswith(('loop', 'ram', 'zram')):
+            continue
+        dev_number = _read(os.path.join(entry, 'dev'))
+        if not dev_number:
+            continue
+        partition = os.path.exists(os.path.join(entry, 'partition'))
+        sys_path = os.path.realpath(entry)
+        disk = os.path.basename(os.path.dirname(sys_path)) if partition else name
+        disk_path = f'/sys/class/block/{disk}'
+        udev = _udev_properties(dev_number)
+
+        uuid = udev.get('ID_FS_UUID')
+        if uuid is None:
+            uuids = _uuids_by_device() if uuids is None else uuids
+            uuid = uuids.get(name)
+        mount_point, mounted_type = mounts.get(dev_number, (None, None))
+        devices[name] = {
+            'name': name,
+            'disk': disk,
+            'partition': partition,
+            'dev': dev_number,
+            'size': int(_read(os.path.join(entry, 'size'), 0)) * 512,
+            'removable': _read(os.path.join(disk_path, 'removable')) == '1',
+            'bus': udev.get('ID_BUS') or ('usb' if '/usb' in sys_path else None),
+            'vendor': udev.get('ID_VENDOR') or _read(os.path.join(disk_path, 'device', 'vendor')),
+            'model': udev.get('ID_MODEL') or _read(os.path.join(disk_path, 'device', 'model')),
+            'serial': udev.get('ID_SERIAL_SHORT') or udev.get('ID_SERIAL') or _read(
+                os.path.join(disk_path, 'device', 'serial')),
+            'uuid': uuid,
+            'label': udev.get('ID_FS_LABEL'),
+            'fs_type': udev.get('ID_FS_TYPE') or mounted_type,
+            'mount_point': mount_point
+        }
+    for device in devices.values():
+        device['has_partitions'] = not device['partition'] and any(
+            other['partition'] and other['disk'] == device['name'] for other in devices.values())
+    return devices
+
+
+def is_pen_drive(device):
+    """Removable or USB storage, or anything mounted under /media as the agent always assumed."""
+    return (device['removable'] or device['bus'] == 'usb' or
+            bool(device['mount_point'] and device['mount_point'].startswith('/media')))
+
+
+class BlockDeviceMonitor:
+    """Keeps ``devices`` current from uevents and mount-table changes, and publishes adds/removes."""
+
+    def __init__(self, interval=2.0, reconcile_interval=300.0, settle=1.0):
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.settle = settle  # udev fills in serials and UUIDs shortly after the kernel event
+        self.backend = None
+        self._devices = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """Register ``callback(added, removed)``, called with lists of device dicts."""
+        self._subscribers.append(callback)
+
+    def devices(self):
+        with self._lock:
+            return dict(self._devices)
+
+    def start(self):
+        self.rescan(publish=False)
+        threading.Thread(target=self._run, name='block-devices', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def rescan(self, publish=True):
+        """Re-read the devices and notify subscribers of what changed; returns ``(added, removed)``."""
+        current = scan_block_devices()
+        with self._lock:
+            previous, self._devices = self._devices, current
+        # A name reused by another medium (a different serial or UUID) is a removal plus an addition
+        changed = {name for name in set(previous) & set(current)
+                   if any(previous[name][key] and current[name][key] and previous[name][key] != current[name][key]
+                          for key in ('serial', 'uuid'))}
+        added = [current[name] for name in sorted(set(current) - set(previous) | changed)]
+        removed = [previous[name] for name in sorted(set(previous) - set(current) | changed)]
+        if publish and (added or removed):
+            for callback in self._subscribers:
+                try:
+                    callback(added, removed)
+                except Exception as e:
+                    log.error("Block device subscriber failed: %s", e)
+        return added, removed
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, KERNEL_UEVENT_GROUP))
+        sock.setblocking(False)
+        return sock
+
+    def _run(self):
+        try:
+            sock = self._open_socket()
+            self.backend = 'netlink'
+        except (AttributeError, OSError) as e:  # AF_NETLINK is missing off Linux
+            log.info("Netlink uevents unavailable (%s); polling /sys/block every %ss.", e, self.interval)
+            sock = None
+            self.backend = 'poll'
+
+        poller = select.poll()
+        mountinfo = None
+        try:
+            mountinfo = open('/proc/self/mountinfo')
+            mountinfo.read()  # poll() reports changes made after the last read
+            poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        except OSError:
+            pass
+        if sock is not None:
+            poller.register(sock, select.POLLIN)
+        timeout = self.reconcile_interval if sock is not None else self.interval
+
+        try:
+            while not self._stop.is_set():
+                ready = poller.poll(timeout * 1000)
+                if ready:
+                    time.sleep(self.settle)  # Let udev and automounters finish, and coalesce the burst
+                    changed = sock is not None and self._drain(sock)
+                    if mountinfo is not None and any(fd == mountinfo.fileno() for fd, _ in ready):
+                        mountinfo.seek(0)
+                        mountinfo.read()
+                        changed = True
+                    if not changed:
+                        continue  # Only uevents of other subsystems (USB hubs, network, ...)
+                self.rescan()
+        finally:
+            if sock is not None:
+                sock.close()
+            if mountinfo is not None:
+                mountinfo.close()
+
+    def _drain(self, sock):
+        """Read every queued uevent; returns whether any was for a block device."""
+        block = False
+        while True:
+            try:
+                block = b'\0SUBSYSTEM=block\0' in sock.recv(65536) or block
+            except BlockingIOError:
+                return block
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                block = True  # Events were lost; rescan to be safe
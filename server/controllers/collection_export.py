@@ -0,0 +1,172 @@
+"""Streaming export of per-MAC collections to columnar files.
+
+Any ``<kind>_<mac>`` collection can be read in cursor batches as pandas
+frames (``iter_frames``) or exported to disk (``export_collection``)
+as Parquet part files or as raw float64 column files that load back as
+``numpy.memmap``. Each export remembers the last ``_id`` it wrote, so
+running it again only appends documents added since.
+
+    python collection_export.py <mac> <kind> <out_dir> [--format parquet|numpy]
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+STATE_FILE = '_export_state.json'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def build_query(start=None, end=None, after_id=None):
+    """Filter on the string ``timestamp`` field and, for incremental runs, on ``_id``."""
+    query = {}
+    if start or end:
+        # Timestamps are stored as '%Y-%m-%d %H:%M:%S' strings, which sort chronologically
+        query['timestamp'] = {}
+        if start:
+            query['timestamp']['$gte'] = start.strftime(TIMESTAMP_FORMAT)
+        if end:
+            query['timestamp']['$lt'] = end.strftime(TIMESTAMP_FORMAT)
+    if after_id:
+        query['_id'] = {'$gt': ObjectId(after_id)}
+    return query
+
+
+def iter_frames(collection, fields=None, start=None, end=None, after_id=None, batch_size=10000):
+    """Yield the matching documents as DataFrames of at most ``batch_size`` rows, in ``_id`` order."""
+    projection = {field: 1 for field in fields} if fields else None
+    cursor = collection.find(build_query(start, end, after_id), projection).sort('_id', 1).batch_size(batch_size)
+    rows = []
+    for document in cursor:
+        rows.append(document)
+        if len(rows) >= batch_size:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def read_frame(collection, fields=None, start=None, end=None, batch_size=10000):
+    """Read the matching documents into a single DataFrame, one cursor batch at a time."""
+    frames = list(iter_frames(collection, fields, start, end, batch_size=batch_size))
+    if not frames:
+        return pd.DataFrame(columns=['_id', *(fields or [])])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _write_parquet(frame, out_dir, part):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from None
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    pq.write_table(table, os.path.join(out_dir, f'part-{part:05d}.parquet'))
+
+
+def _numeric(values):
+    try:
+        return pd.to_numeric(values, errors='coerce')
+    except (TypeError, ValueError):  # nested documents, ObjectIds, ...
+        return pd.Series(np.nan, index=values.index)
+
+
+def _write_numpy(frame, out_dir, state):
+    if 'timestamp' in frame.columns:
+        timestamps = pd.to_datetime(frame['timestamp'], format=TIMESTAMP_FORMAT, errors='coerce')
+        frame['timestamp'] = (timestamps - pd.Timestamp(0)) / pd.Timedelta(seconds=1)
+    if 'columns' not in state:
+        # The first chunk fixes the numeric columns; every later chunk appends to the same files.
+        state['columns'] = [name for name in frame.columns if _numeric(frame[name]).notna().any()]
+    for name in state['columns']:
+        values = _numeric(frame[name]) if name in frame.columns else pd.Series(np.nan, index=frame.index)
+        with open(os.path.join(out_dir, f'{name}.f8'), 'ab') as f:
+            values.to_numpy(dtype=np.float64, na_value=np.nan).tofile(f)
+
+
+def load_numpy(out_dir):
+    """Open a numpy export as ``{column: numpy.memmap}`` without reading it into memory."""
+    state = _load_state(out_dir)
+    rows = state.get('rows', 0)
+    if not rows:
+        return {}
+    return {
+        name: np.memmap(os.path.join(out_dir, f'{name}.f8'), dtype=np.float64, mode='r', shape=(rows,))
+        for name in state.get('columns', [])
+    }
+
+
+def export_collection(client, mac_address, kind, out_dir, fmt='parquet', fields=None,
+                      start=None, end=None, batch_size=10000, incremental=True):
+    """Stream ``<kind>_<mac>`` into ``out_dir``; returns the number of documents written."""
+    if fmt not in ('parquet', 'numpy'):
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+    if not incremental:
+        # A full export starts over; appending to the old files would misalign them.
+        for name in os.listdir(out_dir):
+            if name == STATE_FILE or name.endswith(('.parquet', '.f8')):
+                os.remove(os.path.join(out_dir, name))
+    state = _load_state(out_dir)
+    if state.get('format', fmt) != fmt:
+        raise ValueError(f"{out_dir} already holds a {state['format']} export")
+    state['format'] = fmt
+
+    collection = client[mac_address][f'{kind}_{mac_address}']
+    written = 0
+    for frame in iter_frames(collection, fields, start, end, state.get('last_id'), batch_size):
+        last_id = str(frame['_id'].iloc[-1])
+        frame = frame.drop(columns=['_id'])
+        if fmt == 'parquet':
+            _write_parquet(frame, out_dir, state.get('parts', 0))
+            state['parts'] = state.get('parts', 0) + 1
+        else:
+            _write_numpy(frame, out_dir, state)
+        state['rows'] = state.get('rows', 0) + len(frame)
+        state['last_id'] = last_id
+        # Save after every chunk so an interrupted export resumes where it stopped.
+        _save_state(out_dir, state)
+        written += len(frame)
+    return written
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Export a <kind>_<mac> collection to columnar files.")
+    parser.add_argument('mac_address')
+    parser.add_argument('kind', help="collection prefix, e.g. system_health or process_details")
+    parser.add_argument('out_dir')
+    parser.add_argument('--format', choices=['parquet', 'numpy'], default='parquet')
+    parser.add_argument('--fields', nargs='*', help="fields to export (default: all)")
+    parser.add_argument('--since', type=datetime.fromisoformat, help="ISO start time")
+    parser.add_argument('--until', type=datetime.fromisoformat, help="ISO end time")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--full', action='store_true', help="ignore the saved high-water mark")
+    args = parser.parse_args()
+
+    load_dotenv()
+    count = export_collection(MongoClient(os.getenv('MONGO_URL')), args.mac_address, args.kind, args.out_dir,
+                              fmt=args.format, fields=args.fields, start=args.since, end=args.until,
+                              batch_size=args.batch_size, incremental=not args.full)
+    print(f"Exported {count} documents from {args.kind}_{args.mac_address} to {args.out_dir}.")
@@ -0,0 +1,124 @@
+"""Bounded reverse-DNS cache shared by the tracking agents.
+
+Successful and failed lookups are cached with separate TTLs, the least
+recently used entry is evicted once ``max_size`` is reached, and the
+cache can be saved to a JSON file so a restarted agent starts warm.
+"""
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+
+class DNSCache:
+    """TTL + LRU cache of ``ip -> hostname`` with negative caching."""
+
+    def __init__(self, max_size=4096, positive_ttl=3600, negative_ttl=300, path=None):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+
+        self._entries = OrderedDict()  # ip -> (hostname or None, expires_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, ip_address):
+        """Return ``(found, hostname)``; ``hostname`` is None for a cached failure."""
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    del self._entries[ip_address]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(ip_address)
+            self.hits += 1
+            return True, entry[0]
+
+    def set(self, ip_address, hostname):
+        """Cache a lookup result; pass ``hostname=None`` to record a failure."""
+        ttl = self.positive_ttl if hostname else self.negative_ttl
+        with self._lock:
+            self._entries[ip_address] = (hostname, time.time() + ttl)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def resolve(self, ip_address):
+        """Cached ``socket.gethostbyaddr``; returns None when the address has no name."""
+        found, hostname = self.get(ip_address)
+        if found:
+            return hostname
+        try:
+            hostname = socket.gethostbyaddr(ip_address)[0]
+        except (socket.herror, socket.gaierror, OSError):
+            hostname = None
+        self.set(ip_address, hostname)
+        return hostname
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def load(self):
+        """Load unexpired entries from ``path``; a missing or corrupt file is ignored."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for ip_address, hostname, expires_at in saved:
+                if expires_at > now:
+                    self._entries[ip_address] = (hostname, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Write the cache to ``path`` atomically."""
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = [[ip, hostname, expires_at] for ip, (hostname, expires_at) in self._entries.items()]
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("Error saving DNS cache to %s: %s", self.path, e)
+
+
+def cache_from_env():
+    """Build a ``DNSCache`` configured from ``DNS_CACHE_*`` environment variables."""
+    return DNSCache(
+        max_size=int(os.getenv('DNS_CACHE_SIZE', 4096)),
+        positive_ttl=float(os.getenv('DNS_CACHE_TTL', 3600)),
+        negative_ttl=float(os.getenv('DNS_CACHE_NEGATIVE_TTL', 300)),
+        path=os.getenv('DNS_CACHE_PATH') or None,
+    )
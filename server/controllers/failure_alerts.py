@@ -0,0 +1,101 @@
+"""Forecast intervals, anomaly detection and alert throttling for ``failure_alerts_<mac>``.
+
+* ``prediction_interval`` turns a point forecast into a confidence interval,
+  from the spread of a forest's trees and the model's recent error.
+* ``AnomalyDetector`` scores the newest readings in the health ring buffer
+  with a robust (median/MAD) z-score against the preceding baseline.
+* ``AlertThrottle`` only writes an alert once a condition has held for a few
+  consecutive checks, then stays quiet for a cooldown while it persists; the
+  next alert records how many repeats were suppressed.
+"""
+import time
+import warnings
+from statistics import NormalDist
+
+import numpy as np
+
+ANOMALY_FIELDS = ['cpu_usage', 'load_1m', 'memory_used', 'swap_percent', 'temperature',
+                  'disk_read_rate', 'disk_write_rate']
+
+
+def prediction_interval(model, X, mae=None, level=0.9):
+    """``(prediction, lower, upper)`` for the single row ``X`` (already scaled for ``model``)."""
+    prediction = float(model.predict(X)[0])
+    variance = 0.0
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is not None and len(estimators) > 1:
+        # Disagreement between trees approximates the model's own uncertainty
+        variance += float(np.var([tree.predict(X)[0] for tree in estimators]))
+    if mae:
+        # Noise the model cannot explain; MAE * sqrt(pi/2) is the standard deviation of normal errors
+        variance += (mae * 1.2533) ** 2
+    half_width = NormalDist().inv_cdf(0.5 + level / 2) * variance ** 0.5
+    return prediction, prediction - half_width, prediction + half_width
+
+
+class AnomalyDetector:
+    """Robust z-scores of the last ``recent_seconds`` of samples against the ``baseline_seconds`` before."""
+
+    def __init__(self, fields, watch=ANOMALY_FIELDS, baseline_seconds=600, recent_seconds=15,
+                 threshold=4.0, min_samples=60, min_scale=1.0):
+        self.fields = list(fields)
+        self.watch = [field for field in watch if field in self.fields]
+        self.columns = [self.fields.index(field) for field in self.watch]
+        self.baseline_seconds = baseline_seconds
+        self.recent_seconds = recent_seconds
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.min_scale = min_scale  # Floor for the MAD, in field units, so flat baselines don't alert on noise
+
+    def check(self, times, values):
+        """Return ``[(field, value, zscore)]`` for watched fields unusually high in the recent samples."""
+        if not len(times):
+            return []
+        values = values[:, self.columns]
+        recent = times > times[-1] - self.recent_seconds
+        baseline = ~recent & (times > times[-1] - self.recent_seconds - self.baseline_seconds)
+        if baseline.sum() < self.min_samples or not recent.any():
+            return []
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns, e.g. no temperature sensors
+            median = np.nanmedian(values[baseline], axis=0)
+            mad = np.nanmedian(np.abs(values[baseline] - median), axis=0)
+            current = np.nanmean(values[recent], axis=0)
+        scale = np.maximum(1.4826 * mad, self.min_scale)
+        zscores = (current - median) / scale
+        return [(field, float(current[i]), float(zscores[i]))
+                for i, field in enumerate(self.watch) if zscores[i] > self.threshold]
+
+
+class AlertThrottle:
+    """Writes alerts to ``collection`` with confirmation, cooldown and repeat suppression per alert key."""
+
+    def __init__(self, writer, collection, cooldown=900, confirmations=3):
+        self.writer = writer
+        self.collection = collection
+        self.cooldown = cooldown
+        self.confirmations = confirmations
+        self._state = {}  # key -> {'streak', 'sent_at', 'suppressed'}
+
+    def observe(self, key, active, document):
+        """Record whether condition ``key`` currently holds; writes ``document`` when an alert is due.
+
+        Returns True if the alert was written.
+        """
+        state = self._state.setdefault(key, {'streak': 0, 'sent_at': None, 'suppressed': 0})
+        if not active:
+            state['streak'] = 0
+            return False
+        state['streak'] += 1
+        if state['streak'] < self.confirmations:
+            return False
+        now = time.monotonic()
+        if state['sent_at'] is not None and now - state['sent_at'] < self.cooldown:
+            state['suppressed'] += 1
+            return False
+
+        document = {**document, 'alert_key': key, 'suppressed_repeats': state['suppressed']}
+        self.writer.put(self.collection, document)
+        state['sent_at'], state['suppressed'] = now, 0
+        return True
@@ -0,0 +1,173 @@
+"""File-activity audit for the tracking agents.
+
+``FileAuditor`` watches a few chosen directories (by default the user's
+Desktop, Documents and Downloads) instead of the agent's working
+directory. Events pass through include/exclude globs, and every event on
+one path within a ``window`` is merged into a single summary: first and
+last event time plus a count per event type. Once per window the
+summaries are queued as one batch for ``file_activity_<mac>``. At most
+``max_paths`` paths are kept per window; the overflow is only counted.
+
+On Linux each watched directory costs an inotify watch out of
+``fs.inotify.max_user_watches``. The usage is exposed as metrics and
+logged when it nears the limit.
+"""
+import atexit
+import glob
+import os
+import threading
+import time
+from datetime import datetime
+from fnmatch import fnmatch
+
+from watchdog.events import FileSystemEventHandler
+
+from agent_log import get_logger
+from agent_metrics import metrics
+
+log = get_logger('file_audit')
+
+DEFAULT_EXCLUDE = ('*.swp', '*.tmp', '*~', '.~lock.*', '*/.git/*', '*/__pycache__/*', '*/node_modules/*',
+                   '*/.cache/*')
+
+
+def inotify_watch_usage():
+    """``(watches held by this process, max_user_watches)``, or None outside Linux."""
+    try:
+        with open('/proc/sys/fs/inotify/max_user_watches') as f:
+            limit = int(f.read())
+    except (OSError, ValueError):
+        return None
+    watches = 0
+    for path in glob.glob('/proc/self/fdinfo/*'):
+        try:
+            with open(path) as f:
+                watches += sum(1 for line in f if line.startswith('inotify wd:'))
+        except OSError:
+            continue  # The descriptor closed while we were listing
+    return watches, limit
+
+
+class FileAuditor(FileSystemEventHandler):
+    """Summarizes file events per path and window, and batch-writes the summaries to ``collection``."""
+
+    def __init__(self, collection, writer, paths, include=('*',), exclude=DEFAULT_EXCLUDE, window=5.0,
+                 max_paths=5000, recursive=True):
+        super().__init__()
+        self.collection = collection
+        self.writer = writer
+        self.paths = [os.path.abspath(os.path.expanduser(path)) for path in paths]
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.window = window
+        self.max_paths = max_paths
+        self.recursive = recursive
+
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> summary document
+        self._overflow = 0
+        self._stop = threading.Event()
+        self.events = 0
+        self.written = 0
+
+        metrics.register('agent_file_audit_events_total', lambda: self.events, kind='counter')
+
+    def matches(self, path):
+        """Whether ``path`` passes the globs; a pattern matches the full path or the file name."""
+        name = os.path.basename(path)
+        if any(fnmatch(path, pattern) or fnmatch(name, pattern) for pattern in self.exclude):
+            return False
+        return any(fnmatch(path, pattern) or fnmatch(name, pattern) for pattern in self.include)
+
+    def start(self, observer):
+        """Watch every existing path on ``observer`` and start writing a batch per window."""
+        watched = [path for path in self.paths if os.path.isdir(path)]
+        for path in watched:
+            observer.schedule(self, path, recursive=self.recursive)
+        log.info("Auditing file activity under %s.", ', '.join(watched) or 'no existing paths')
+        usage = inotify_watch_usage()
+        if usage:
+            metrics.register('agent_inotify_watches', lambda: (inotify_watch_usage() or (0, 0))[0])
+            metrics.register('agent_inotify_max_user_watches', lambda: usage[1])
+            if usage[0] > 0.8 * usage[1]:
+                log.warning("Using %d of %d inotify watches (fs.inotify.max_user_watches); "
+                            "narrow FILE_AUDIT_PATHS or raise the limit.", *usage)
+        threading.Thread(target=self._run, name='file-audit', daemon=True).start()
+        atexit.register(self.close)
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type in ('opened', 'closed', 'closed_no_write'):
+            return
+        path = event.src_path
+        dest_path = getattr(event, 'dest_path', '') or None
+        if not self.matches(path) and not (dest_path and self.matches(dest_path)):
+            return
+        now = time.time()
+        with self._lock:
+            self.events += 1
+            summary = self._pending.get(path)
+            if summary is None:
+                if len(self._pending) >= self.max_paths:
+                    self._overflow += 1
+                    return
+                summary = self._pending[path] = {'path': path, 'first': now, 'events': {}}
+            summary['last'] = now
+            summary['events'][event.event_type] = summary['events'].get(event.event_type, 0) + 1
+            if dest_path:
+                summary['dest_path'] = dest_path
+
+    def flush(self):
+        """Queue one summary document per path seen since the previous flush."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            overflow, self._overflow = self._overflow, 0
+        if overflow:
+            log.warning("File audit window overflowed: %d events on more than %d paths were only counted.",
+                        overflow, self.max_paths)
+        if not pending:
+            return
+        documents = []
+        for summary in pending.values():
+            document = {
+                'timestamp': datetime.fromtimestamp(summary['first']).strftime('%Y-%m-%d %H:%M:%S'),
+                'last_event': datetime.fromtimestamp(summary['last']).strftime('%Y-%m-%d %H:%M:%S'),
+                'path': summary['path'],
+                'events': summary['events'],
+                'count': sum(summary['events'].values())
+            }
+            if 'dest_path' in summary:
+                document['dest_path'] = summary['dest_path']
+            documents.append(document)
+        self.writer.put_many(self.collection, documents)
+        self.written += len(documents)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def _split(value, separator=','):
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+def auditor_from_env(collection, writer):
+    """Build a ``FileAuditor`` configured from ``FILE_AUDIT_*`` environment variables.
+
+    ``FILE_AUDIT_PATHS`` is a ``os.pathsep``-separated list of directories; the
+    globs in ``FILE_AUDIT_INCLUDE`` / ``FILE_AUDIT_EXCLUDE`` are comma-separated.
+    """
+    default_paths = os.pathsep.join(os.path.join('~', name) for name in ('Desktop', 'Documents', 'Downloads'))
+    exclude = os.getenv('FILE_AUDIT_EXCLUDE')
+    return FileAuditor(
+        collection, writer,
+        paths=_split(os.getenv('FILE_AUDIT_PATHS', default_paths), os.pathsep),
+        include=_split(os.getenv('FILE_AUDIT_INCLUDE', '*')),
+        exclude=_split(exclude) if exclude is not None else DEFAULT_EXCLUDE,
+        window=float(os.getenv('FILE_AUDIT_WINDOW', 5)),
+        max_paths=int(os.getenv('FILE_AUDIT_MAX_PATHS', 5000)),
+        recursive=os.getenv('FILE_AUDIT_RECURSIVE', '1') == '1',
+    )
@@ -0,0 +1,90 @@
+"""Filesystem-event triggers for collectors whose input is a set of files.
+
+A ``DebouncedTrigger`` is a watchdog handler for a few directories. It
+calls ``callback`` once a burst of events on the named files has been
+quiet for ``debounce`` seconds, or ``max_delay`` seconds after the burst
+began if it never goes quiet. All the events of a burst are coalesced
+into one call. An idle machine makes no calls at all, and the first write
+after idling is handled within ``debounce`` seconds.
+"""
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+
+from agent_log import get_logger
+
+log = get_logger('triggers')
+
+# Files a browser writes when it records a visit: the database itself and its journal
+HISTORY_FILE_NAMES = {'History', 'History-journal', 'History-wal', 'places.sqlite', 'places.sqlite-wal'}
+
+
+class DebouncedTrigger(FileSystemEventHandler):
+    """Coalesces events on ``names`` within watched directories into debounced ``callback()`` calls."""
+
+    def __init__(self, callback, names=None, debounce=2.0, max_delay=10.0, name='trigger'):
+        super().__init__()
+        self.callback = callback
+        self.names = set(names) if names else None
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._first_event = None  # Monotonic time the pending burst began
+        self._last_event = None
+        self.events = 0
+        self.calls = 0
+
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def watch(self, observer, directories):
+        """Schedule this handler on every existing directory in ``directories``, non-recursively."""
+        watched = 0
+        for directory in sorted(set(directories)):
+            if os.path.isdir(directory):
+                observer.schedule(self, directory, recursive=False)
+                watched += 1
+        return watched
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if self.names and not any(os.path.basename(path) in self.names for path in paths if path):
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.events += 1
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                # Check the deadline and end the burst under one lock, so no event slips in between
+                with self._lock:
+                    first, last = self._first_event, self._last_event
+                    if first is None:
+                        break
+                    due = min(last + self.debounce, first + self.max_delay)
+                    if time.monotonic() >= due:
+                        self._first_event = self._last_event = None
+                        break
+                # Woken early by another event of the same burst; recompute the deadline
+                self._wake.wait(due - time.monotonic())
+                self._wake.clear()
+            if first is None:
+                continue  # This burst was already handled by the previous call
+            self.calls += 1
+            try:
+                self.callback()
+            except Exception as e:
+                log.error("Trigger %s failed: %s", self.name, e)
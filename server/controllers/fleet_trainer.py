@@ -0,0 +1,162 @@
+"""Fleet-wide training of the failure-prediction model, off the monitored machines.
+
+Finds every ``<mac>`` database holding a ``system_health_<mac>`` collection,
+builds features for each host in a process pool, and publishes versioned
+artifacts to the shared ``ModelStore``. Agents started with
+``TRAINING_MODE=fleet`` download the artifact for their MAC address (or the
+pooled one) and only score with it.
+
+    python fleet_trainer.py [--mode per-host|pooled|both] [--workers N] [--since ISO]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+from pymongo import MongoClient
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from collection_export import read_frame
+from health_features import FeaturePipeline
+from model_registry import ModelStore
+
+# Set in each worker process; MongoClient must not be shared across a fork
+_client = None
+
+
+def _init_worker(mongo_url):
+    global _client
+    _client = MongoClient(mongo_url)
+
+
+def find_hosts(client):
+    """MAC addresses whose database has a ``system_health_<mac>`` collection."""
+    hosts = []
+    for name in client.list_database_names():
+        if f'system_health_{name}' in client[name].list_collection_names():
+            hosts.append(name)
+    return sorted(hosts)
+
+
+def load_host(mac_address, pipeline, since=None):
+    """``(X, y)`` training arrays for one host, built in a worker process."""
+    collection = _client[mac_address][f'system_health_{mac_address}']
+    data = read_frame(collection, fields=pipeline.fields, start=since)
+    return pipeline.training_arrays(pipeline.raw(data))
+
+
+def fit_model(X, y, n_estimators=100, n_jobs=1):
+    """Fit the scaler and forest used by the agents; returns ``(model, scaler, metrics)``."""
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+    model.fit(X_train, y_train)
+    test_predictions = model.predict(X_test)
+    metrics = {
+        'samples': int(len(y)),
+        'r2': float(r2_score(y_test, test_predictions)),
+        'mae': float(mean_absolute_error(y_test, test_predictions))
+    }
+    return model, scaler, metrics
+
+
+def train_host(mac_address, pipeline, since=None, min_samples=30):
+    """Train and publish the model for one host; returns its metrics, or None without enough data."""
+    X, y = load_host(mac_address, pipeline, since)
+    if len(y) < min_samples:
+        return None
+    model, scaler, metrics = fit_model(X, y)
+    store = ModelStore(_client[os.getenv('FLEET_MODEL_DB', 'fleet_models')])
+    metrics['version'] = store.publish(f'{mac_address}_model.joblib', model, scaler, {
+        **metrics,
+        'features': pipeline.signature,
+        'trained_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    return metrics
+
+
+def train_fleet(mongo_url, mode='per-host', workers=None, since=None, pipeline=None, min_samples=30):
+    """Train every host in parallel; ``pooled`` also fits one model on all hosts' samples together."""
+    pipeline = pipeline or FeaturePipeline()
+    client = MongoClient(mongo_url)
+    hosts = find_hosts(client)
+    print(f"Found {len(hosts)} hosts with system health data.")
+    results = {}
+
+    # spawn: worker processes open their own MongoClient instead of inheriting this one
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=_init_worker, initargs=(mongo_url,)) as pool:
+        if mode in ('per-host', 'both'):
+            futures = {pool.submit(train_host, mac, pipeline, since, min_samples): mac for mac in hosts}
+            for future in as_completed(futures):
+                mac = futures[future]
+                try:
+                    results[mac] = future.result()
+                except Exception as e:
+                    print(f"Training failed for {mac}: {e}")
+                    continue
+                if results[mac] is None:
+                    print(f"Skipped {mac}: not enough data.")
+                else:
+                    print(f"Published {mac} model version {results[mac]['version']} "
+                          f"(MAE {results[mac]['mae']:.2f}, {results[mac]['samples']} samples).")
+
+        if mode in ('pooled', 'both'):
+            # Features are built per host so rolling windows never span two machines
+            futures = [pool.submit(load_host, mac, pipeline, since) for mac in hosts]
+            arrays = []
+            for future in as_completed(futures):
+                try:
+                    arrays.append(future.result())
+                except Exception as e:
+                    print(f"Loading host data failed: {e}")
+            arrays = [(X, y) for X, y in arrays if len(y)]
+            if sum(len(y) for _, y in arrays) >= min_samples:
+                X = np.vstack([X for X, _ in arrays])
+                y = np.concatenate([y for _, y in arrays])
+                model, scaler, metrics = fit_model(X, y, n_jobs=workers or -1)
+                store = ModelStore(client[os.getenv('FLEET_MODEL_DB', 'fleet_models')])
+                metrics['version'] = store.publish('pooled_model.joblib', model, scaler, {
+                    **metrics,
+                    'hosts': len(arrays),
+                    'features': pipeline.signature,
+                    'trained_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+                results['pooled'] = metrics
+                print(f"Published pooled model version {metrics['version']} from {len(arrays)} hosts "
+                      f"(MAE {metrics['mae']:.2f}, {metrics['samples']} samples).")
+            else:
+                print("Not enough data across the fleet for a pooled model.")
+    return results
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Train failure-prediction models for every host.")
+    parser.add_argument('--mode', choices=['per-host', 'pooled', 'both'], default='per-host')
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--since', type=datetime.fromisoformat, help="only train on samples after this ISO time")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="retrain every INTERVAL seconds instead of running once")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Must match the agents' pipeline, or they will ignore the published models
+    forecast_minutes = float(os.getenv('FORECAST_HORIZON_MINUTES', 5))
+    window_seconds = float(os.getenv('HEALTH_WINDOW_SECONDS', 15))
+    pipeline = FeaturePipeline(horizon=max(1, round(forecast_minutes * 60 / window_seconds)))
+
+    while True:
+        started = time.monotonic()
+        train_fleet(os.getenv('MONGO_URL'), args.mode, args.workers, args.since, pipeline)
+        if not args.interval:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
@@ -0,0 +1,68 @@
+"""In-memory flow table used to aggregate captured packets.
+
+Packets are folded into flows keyed by the 5-tuple
+``(protocol, src_ip, src_port, dst_ip, dst_port)``. A flow is exported
+once it has been idle for ``idle_timeout`` seconds or has been open for
+``active_timeout`` seconds, whichever comes first.
+"""
+
+
+class Flow:
+    """Packet/byte counters and first/last-seen times for one 5-tuple."""
+    __slots__ = ('first_seen', 'last_seen', 'packets', 'bytes')
+
+    def __init__(self, timestamp):
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets = 0
+        self.bytes = 0
+
+
+class FlowTable:
+    """Aggregates packets into flows and hands back the ones that are due for export."""
+
+    def __init__(self, idle_timeout=30, active_timeout=60, max_flows=100000):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self._flows = {}
+
+    def __len__(self):
+        return len(self._flows)
+
+    def __contains__(self, key):
+        return key in self._flows
+
+    def add(self, key, timestamp, length, packets=1):
+        """Account ``packets`` packets totalling ``length`` bytes to the flow ``key``.
+
+        Returns a flow that had to be evicted to stay under ``max_flows``, or None.
+        """
+        flow = self._flows.get(key)
+        evicted = None
+        if flow is None:
+            if len(self._flows) >= self.max_flows:
+                # Dicts keep insertion order, so the first key is the oldest flow.
+                oldest = next(iter(self._flows))
+                evicted = (oldest, self._flows.pop(oldest))
+            flow = self._flows[key] = Flow(timestamp)
+        flow.last_seen = timestamp
+        flow.packets += packets
+        flow.bytes += length
+        return evicted
+
+    def expire(self, now):
+        """Remove and return ``(key, flow)`` pairs that went idle or whose window closed."""
+        expired = [
+            (key, flow) for key, flow in self._flows.items()
+            if now - flow.last_seen >= self.idle_timeout or now - flow.first_seen >= self.active_timeout
+        ]
+        for key, _ in expired:
+            del self._flows[key]
+        return expired
+
+    def drain(self):
+        """Remove and return every flow, e.g. on shutdown."""
+        flows = list(self._flows.items())
+        self._flows.clear()
+        return flows
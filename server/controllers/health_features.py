@@ -0,0 +1,115 @@
+"""Vectorized feature engineering for failure prediction.
+
+``FeaturePipeline`` turns a time-ordered frame of health samples (stored
+``system_health_<mac>`` documents, an export, or the sampler's window
+means) into model features: the raw readings plus rolling means, rolling
+least-squares slopes and lags, all computed with pandas rolling windows
+instead of per-sample Python loops. Training and ``predict_failure`` use
+the same pipeline, so the features always line up.
+"""
+import numpy as np
+import pandas as pd
+
+from health_sampler import FIELDS
+
+# Rows without these are unusable; other readings may be missing on some hosts (or in old documents)
+REQUIRED_FIELDS = ['cpu_usage', 'memory_used', 'disk_used']
+TREND_FIELDS = ['cpu_usage', 'load_1m', 'memory_used', 'disk_read_rate', 'disk_write_rate']
+
+
+def rolling_slope(values, window):
+    """Least-squares slope per row over the last ``window`` rows."""
+    index = pd.Series(np.arange(len(values), dtype=float), index=values.index)
+    mean_x = index.rolling(window).mean()
+    mean_y = values.rolling(window).mean()
+    mean_xy = (index * values).rolling(window).mean()
+    # Variance of 0..window-1, the same for every full window
+    return (mean_xy - mean_x * mean_y) / ((window ** 2 - 1) / 12)
+
+
+class FeaturePipeline:
+    """Builds the feature matrix shared by training and prediction."""
+
+    def __init__(self, fields=FIELDS, trend_fields=TREND_FIELDS, windows=(4, 20), lags=(1, 2, 3),
+                 target='cpu_usage', horizon=1):
+        self.fields = list(fields)
+        self.trend_fields = [field for field in trend_fields if field in self.fields]
+        self.windows = tuple(windows)
+        self.lags = tuple(lags)
+        self.target = target
+        self.horizon = horizon  # Rows ahead the target is taken from
+
+        self.columns = list(self.fields)
+        for field in self.trend_fields:
+            self.columns += [f'{field}_mean_{w}' for w in self.windows]
+            self.columns += [f'{field}_slope_{w}' for w in self.windows]
+        self.columns += [f'{target}_lag_{lag}' for lag in self.lags]
+
+    @property
+    def signature(self):
+        """Identifies the features and target, so models built for another pipeline can be detected."""
+        return {'columns': self.columns, 'target': self.target, 'horizon': self.horizon}
+
+    @property
+    def history(self):
+        """Rows of context needed before the first complete feature row."""
+        return max(max(self.windows), max(self.lags) + 1)
+
+    def raw(self, frame):
+        """The raw health fields as floats, with optional readings that are missing set to 0."""
+        raw = frame.reindex(columns=self.fields).apply(pd.to_numeric, errors='coerce')
+        optional = [field for field in self.fields if field not in REQUIRED_FIELDS]
+        raw[optional] = raw[optional].fillna(0.0)
+        return raw.dropna().reset_index(drop=True)
+
+    def transform(self, raw):
+        """Feature frame for every row of ``raw``; rows without enough history are NaN."""
+        features = {field: raw[field] for field in self.fields}
+        for field in self.trend_fields:
+            for w in self.windows:
+                features[f'{field}_mean_{w}'] = raw[field].rolling(w).mean()
+            for w in self.windows:
+                features[f'{field}_slope_{w}'] = rolling_slope(raw[field], w)
+        for lag in self.lags:
+            features[f'{self.target}_lag_{lag}'] = raw[self.target].shift(lag)
+        return pd.DataFrame(features, columns=self.columns)
+
+    def training_arrays(self, raw, first_target=0):
+        """``(X, y)`` from a ``raw`` frame for rows whose target, ``horizon`` rows later, is known.
+
+        Rows whose target lies before position ``first_target`` are skipped, so
+        callers that prepend already-trained context only get the new rows.
+        """
+        features = self.transform(raw)
+        target = raw[self.target].shift(-self.horizon)
+        keep = features.notna().all(axis=1) & target.notna()
+        keep &= np.arange(len(raw)) + self.horizon >= first_target
+        return features[keep].to_numpy(dtype=float), target[keep].to_numpy(dtype=float)
+
+    def latest(self, frame):
+        """Feature row for the newest sample, or None without enough history."""
+        raw = self.raw(frame).tail(self.history)
+        if len(raw) < self.history:
+            return None
+        row = self.transform(raw.reset_index(drop=True)).iloc[[-1]]
+        if row.isna().any(axis=None):
+            return None
+        return row.to_numpy(dtype=float)
+
+
+def recent_health_frame(pipeline, sampler=None, collection=None):
+    """The last ``pipeline.history`` rows at the stored-document cadence.
+
+    Uses the sampler's ring buffer when it already covers enough windows and
+    otherwise the newest documents in ``collection``.
+    """
+    if sampler is not None:
+        means = sampler.window_means(pipeline.history)
+        if len(means) >= pipeline.history:
+            return pd.DataFrame(means, columns=sampler.fields)
+    if collection is None:
+        return pd.DataFrame(columns=pipeline.fields)
+    projection = {field: 1 for field in pipeline.fields}
+    documents = list(collection.find({}, projection).sort('_id', -1).limit(pipeline.history))
+    documents.reverse()
+    return pd.DataFrame(documents)
@@ -0,0 +1,192 @@
+"""Fixed-cadence system health sampler backed by a NumPy ring buffer.
+
+``HealthSampler`` reads CPU (overall and per core), load average, memory,
+swap, disk usage, disk/network I/O rates and temperature every ``interval``
+seconds using non-blocking ``psutil`` counter deltas, keeps the last
+``capacity`` samples in a ring buffer, and every ``window`` seconds hands
+a downsampled min/mean/max/p95 summary to ``on_window``. Prediction reads
+the latest sample from the buffer instead of blocking on a new one.
+"""
+import threading
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import psutil
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+# Columns of the ring buffer: memory and disk in GB, I/O rates in MB/s, temperature in degrees C
+FIELDS = [
+    'cpu_usage', 'cpu_core_max', 'cpu_core_std', 'load_1m',
+    'memory_used', 'memory_total', 'swap_percent', 'disk_used', 'disk_total',
+    'disk_read_rate', 'disk_write_rate', 'net_recv_rate', 'net_sent_rate', 'temperature'
+]
+
+
+class SystemReader:
+    """Takes non-blocking samples; CPU usage and I/O rates cover the time since the previous call."""
+
+    def __init__(self):
+        self._last_time = None
+        self._last_io = None
+
+    def _io_counters(self):
+        disk = psutil.disk_io_counters()
+        net = psutil.net_io_counters()
+        return (disk.read_bytes if disk else 0, disk.write_bytes if disk else 0,
+                net.bytes_recv if net else 0, net.bytes_sent if net else 0)
+
+    def _temperature(self):
+        sensors = getattr(psutil, 'sensors_temperatures', None)  # Linux/FreeBSD only
+        try:
+            readings = [entry.current for entries in (sensors() if sensors else {}).values() for entry in entries]
+        except (OSError, AttributeError):
+            readings = []
+        return max(readings) if readings else np.nan
+
+    def __call__(self):
+        now = time.monotonic()
+        io = self._io_counters()
+        if self._last_io is None or now <= self._last_time:
+            rates = [0.0] * len(io)
+        else:
+            rates = [max(0, new - old) / (1024**2) / (now - self._last_time) for new, old in zip(io, self._last_io)]
+        self._last_time, self._last_io = now, io
+
+        per_core = psutil.cpu_percent(interval=None, percpu=True) or [0.0]
+        memory_info = psutil.virtual_memory()
+        disk_usage = psutil.disk_usage('/')
+        return [
+            psutil.cpu_percent(interval=None),
+            max(per_core),
+            float(np.std(per_core)),
+            psutil.getloadavg()[0],
+            memory_info.used / (1024**3),
+            memory_info.total / (1024**3),
+            psutil.swap_memory().percent,
+            disk_usage.used / (1024**3),
+            disk_usage.total / (1024**3),
+            *rates,
+            self._temperature(),
+        ]
+
+
+class HealthSampler:
+    """Samples system health at a fixed cadence into a ring buffer and summarises each window."""
+
+    def __init__(self, interval=1.0, capacity=3600, window=15.0, on_window=None,
+                 fields=FIELDS, read_sample=None):
+        self.interval = interval
+        self.capacity = capacity
+        self.window = window
+        self.on_window = on_window
+        self.fields = list(fields)
+        self.read_sample = read_sample or SystemReader()
+
+        self._values = np.full((capacity, len(self.fields)), np.nan)
+        self._times = np.zeros(capacity)
+        self._next = 0  # slot the next sample goes into
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return self._count
+
+    def record(self, values, timestamp=None):
+        """Append one sample to the ring buffer, overwriting the oldest when full."""
+        with self._lock:
+            self._values[self._next] = values
+            self._times[self._next] = time.time() if timestamp is None else timestamp
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def recent(self, seconds=None):
+        """Return ``(timestamps, values)`` for the buffered samples, oldest first."""
+        with self._lock:
+            order = (np.arange(self._count) + self._next - self._count) % self.capacity
+            times = self._times[order].copy()
+            values = self._values[order].copy()
+        if seconds is not None:
+            keep = times >= time.time() - seconds
+            times, values = times[keep], values[keep]
+        return times, values
+
+    def latest(self):
+        """Return the newest sample in ``collect_system_health_data`` format, or None."""
+        with self._lock:
+            if not self._count:
+                return None
+            slot = (self._next - 1) % self.capacity
+            values, timestamp = self._values[slot].copy(), self._times[slot]
+        sample = {field: round(float(value), 2) for field, value in zip(self.fields, values)}
+        sample['timestamp'] = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        return sample
+
+    def window_means(self, count):
+        """Mean of each of the last ``count`` windows, oldest first, at the cadence of the stored documents."""
+        times, values = self.recent(count * self.window)
+        if not len(times):
+            return np.empty((0, len(self.fields)))
+        # Window 0 ends at the newest sample; count back from there
+        bins = ((times[-1] - times) // self.window).astype(int)
+        present = ~np.isnan(values)
+        sums = np.zeros((bins.max() + 1, values.shape[1]))
+        counts = np.zeros_like(sums)
+        np.add.at(sums, bins, np.where(present, values, 0.0))
+        np.add.at(counts, bins, present)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        return means[np.bincount(bins) > 0][::-1]
+
+    def summarize(self, times, values):
+        """Downsample a window to one document: means under the plain field names plus min/max/p95."""
+        summary = {
+            'timestamp': datetime.fromtimestamp(times[-1]).strftime('%Y-%m-%d %H:%M:%S'),
+            'window_seconds': self.window,
+            'samples': int(len(times))
+        }
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN columns, e.g. no temperature sensors
+            stats = {
+                '': np.nanmean(values, axis=0),
+                '_min': np.nanmin(values, axis=0),
+                '_max': np.nanmax(values, axis=0),
+                '_p95': np.nanpercentile(values, 95, axis=0)
+            }
+        for i, field in enumerate(self.fields):
+            for suffix, column in stats.items():
+                summary[f'{field}{suffix}'] = round(float(column[i]), 2)
+        return summary
+
+    def start(self):
+        """Start sampling on a daemon thread."""
+        self._thread = threading.Thread(target=self._run, name='health-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self.read_sample()  # Prime the CPU and I/O counters; the first reading is meaningless
+        next_run = time.monotonic() + self.interval
+        window_start = time.time()
+        while not self._stop.wait(max(0.0, next_run - time.monotonic())):
+            next_run += self.interval
+            try:
+                self.record(self.read_sample())
+            except Exception as e:
+                log.error("Error sampling system health: %s", e)
+                continue
+
+            now = time.time()
+            if self.on_window and now - window_start >= self.window:
+                times, values = self.recent(now - window_start)
+                window_start = now
+                if len(times):
+                    self.on_window(self.summarize(times, values))
@@ -0,0 +1,110 @@
+"""Incremental browser-history ingestion.
+
+``HistoryIngester`` keeps a high-water mark, the newest visit time already
+stored, for every browser profile and only writes rows at or after it. The
+marks are rebuilt from ``browser_history_<mac>`` itself on start, so
+nothing is lost or duplicated across restarts. Rows are written as upserts
+keyed on ``(url, timestamp)``, so the row sitting exactly on the mark, or a
+row read twice, never produces a second document.
+
+A history source is a callable taking ``since(browser, profile)``, which
+returns that profile's mark as a datetime, and yielding
+``(browser, profile, rows)`` with ``rows`` of ``(timestamp, url, title)``,
+the timestamp already formatted as ``'%Y-%m-%d %H:%M:%S'`` local time. Sources that can filter on the mark should do so; the ingester
+filters again regardless.
+"""
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from agent_log import SAMPLED, get_logger
+
+log = get_logger('history')
+
+
+def library_history(since):
+    """History from the ``browser_history`` package, one browser at a time.
+
+    The package always reads whole databases, so ``since`` is only applied
+    afterwards by the ingester. Profiles are merged, so ``profile`` is None.
+    Prefer ``history_reader.native_history``.
+    """
+    from browser_history.utils import get_browsers
+
+    for browser_class in get_browsers():
+        try:
+            outputs = browser_class().fetch_history()
+        except Exception as e:
+            log.error("Error retrieving %s history: %s", browser_class.name, e)
+            continue
+        yield browser_class.name, None, [(visited.strftime('%Y-%m-%d %H:%M:%S'), url, title)
+                                         for visited, url, title, *_ in outputs.histories]
+
+
+class HistoryIngester:
+    """Writes the history rows newer than each profile's high-water mark to ``collection``."""
+
+    def __init__(self, collection, writer, read_history=library_history, start=None):
+        self.collection = collection
+        self.writer = writer
+        self.read_history = read_history
+        # Without a mark, start from midnight today, as the agent always has
+        start = start or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start = start.strftime('%Y-%m-%d %H:%M:%S')
+        self.marks = None  # (browser, profile) -> newest stored 'timestamp'
+        self._at_mark = {}
+
+    def load_marks(self):
+        """Rebuild the marks from the newest stored visit of every profile."""
+        self.collection.create_index([('url', 1), ('timestamp', 1)])
+        marks = {}
+        for group in self.collection.aggregate([
+                {'$group': {'_id': {'browser': '$browser', 'profile': '$profile'},
+                            'last': {'$max': '$timestamp'}}}]):
+            marks[(group['_id'].get('browser'), group['_id'].get('profile'))] = group['last']
+        # Documents stored before marks existed carry no browser; they bound every profile
+        self.legacy_mark = max(marks.pop((None, None), self.start), self.start)
+        self.marks = marks
+
+    def mark(self, browser, profile):
+        # A profile new to the marks falls back to its browser's mark from before profiles were recorded
+        return self.marks.get((browser, profile)) or self.marks.get((browser, None)) or self.legacy_mark
+
+    def since(self, browser, profile):
+        """``mark`` as a datetime, for sources that filter on it."""
+        return datetime.strptime(self.mark(browser, profile), '%Y-%m-%d %H:%M:%S')
+
+    def run(self):
+        """Queue every new row; returns how many were queued."""
+        if self.marks is None:
+            try:
+                self.load_marks()
+            except PyMongoError as e:
+                log.error("Could not load browser history marks: %s", e)
+                return 0
+
+        queued = 0
+        for browser, profile, rows in self.read_history(self.since):
+            key = (browser, profile)
+            mark = self.mark(browser, profile)
+            at_mark = self._at_mark.get(key, set())  # URLs already stored at exactly the mark
+            newest, new_rows = mark, set()
+            for timestamp, url, title in rows:
+                if not isinstance(url, str) or not url.startswith('http'):
+                    continue
+                if timestamp < mark or (timestamp == mark and url in at_mark) or (url, timestamp) in new_rows:
+                    continue
+                new_rows.add((url, timestamp))
+                document = {'timestamp': timestamp, 'url': url, 'title': title, 'browser': browser}
+                if profile is not None:
+                    document['profile'] = profile
+                log.debug("Adding entry: %s", document, extra=SAMPLED)
+                self.writer.put_update(self.collection, {'url': url, 'timestamp': timestamp},
+                                       {'$setOnInsert': document}, upsert=True)
+                newest = max(newest, timestamp)
+            if new_rows:
+                queued += len(new_rows)
+                urls = {url for url, timestamp in new_rows if timestamp == newest}
+                self.marks[key] = newest
+                self._at_mark[key] = at_mark | urls if newest == mark else urls
+        return queued
@@ -0,0 +1,146 @@
+"""Native, read-only browser-history reader for Chrome, Chromium, Brave and Firefox.
+
+Every profile database is opened with a read-only SQLite URI and queried
+with ``WHERE visit_time >= ?`` on the visit-time index, so a run only
+touches rows newer than the ingester's mark. SQLite turns the browser's
+timestamps into local ``'%Y-%m-%d %H:%M:%S'`` strings inside the query,
+so no Python datetimes are built per row.
+
+A browser that is running keeps its database locked. Without a pending
+``-wal`` or ``-journal`` file the main file is complete, so it is opened
+``immutable=1`` with no locking. Otherwise the database and its WAL or
+rollback journal are copied to a temporary directory first. That snapshot is the only time a
+file is copied.
+"""
+import glob
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from agent_log import get_logger
+from history_ingest import library_history
+
+log = get_logger('history')
+
+# Seconds between 1601-01-01, the Chromium/WebKit epoch, and the Unix epoch
+WEBKIT_EPOCH_OFFSET = 11644473600
+
+CHROMIUM_QUERY = """
+    SELECT strftime('%Y-%m-%d %H:%M:%S', visits.visit_time / 1000000 - {offset}, 'unixepoch', 'localtime'),
+           urls.url, urls.title
+    FROM visits JOIN urls ON urls.id = visits.url
+    WHERE visits.visit_time >= ?
+""".format(offset=WEBKIT_EPOCH_OFFSET)
+
+FIREFOX_QUERY = """
+    SELECT strftime('%Y-%m-%d %H:%M:%S', moz_historyvisits.visit_date / 1000000, 'unixepoch', 'localtime'),
+           moz_places.url, moz_places.title
+    FROM moz_historyvisits JOIN moz_places ON moz_places.id = moz_historyvisits.place_id
+    WHERE moz_historyvisits.visit_date >= ?
+"""
+
+
+def _user_data_dirs():
+    """``{browser: [profile glob patterns]}`` for this operating system."""
+    home = os.path.expanduser('~')
+    system = platform.system().lower()
+    if system == 'windows':
+        local = os.getenv('LOCALAPPDATA', os.path.join(home, 'AppData', 'Local'))
+        roaming = os.getenv('APPDATA', os.path.join(home, 'AppData', 'Roaming'))
+        chromium = {
+            'Chrome': os.path.join(local, 'Google', 'Chrome', 'User Data'),
+            'Chromium': os.path.join(local, 'Chromium', 'User Data'),
+            'Brave': os.path.join(local, 'BraveSoftware', 'Brave-Browser', 'User Data')
+        }
+        firefox = os.path.join(roaming, 'Mozilla', 'Firefox', 'Profiles')
+    elif system == 'darwin':
+        support = os.path.join(home, 'Library', 'Application Support')
+        chromium = {
+            'Chrome': os.path.join(support, 'Google', 'Chrome'),
+            'Chromium': os.path.join(support, 'Chromium'),
+            'Brave': os.path.join(support, 'BraveSoftware', 'Brave-Browser')
+        }
+        firefox = os.path.join(support, 'Firefox', 'Profiles')
+    else:
+        config = os.getenv('XDG_CONFIG_HOME', os.path.join(home, '.config'))
+        chromium = {
+            'Chrome': os.path.join(config, 'google-chrome'),
+            'Chromium': os.path.join(config, 'chromium'),
+            'Brave': os.path.join(config, 'BraveSoftware', 'Brave-Browser')
+        }
+        firefox = os.path.join(home, '.mozilla', 'firefox')
+    patterns = {name: [os.path.join(path, 'Default', 'History'), os.path.join(path, 'Profile *', 'History')]
+                for name, path in chromium.items()}
+    patterns['Firefox'] = [os.path.join(firefox, '*', 'places.sqlite')]
+    return patterns
+
+
+def find_profiles(browsers=None):
+    """``[(browser, profile, database path)]`` for every profile on this machine."""
+    profiles = []
+    for browser, patterns in _user_data_dirs().items():
+        if browsers and browser.lower() not in browsers:
+            continue
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                profiles.append((browser, os.path.basename(os.path.dirname(path)), path))
+    return profiles
+
+
+def _query(path, options, query, since):
+    connection = sqlite3.connect(f'{Path(path).absolute().as_uri()}{options}', uri=True)
+    try:
+        return connection.execute(query, (since,)).fetchall()
+    finally:
+        connection.close()
+
+
+def read_profile(path, query, since):
+    """Rows of ``query`` with visit time ``>= since``, without writing to or blocking on ``path``."""
+    try:
+        return _query(path, '?mode=ro', query, since)
+    except sqlite3.OperationalError as e:
+        if 'locked' not in str(e):
+            raise
+    # Locked by the running browser: read the file as-is unless part of the data is still elsewhere
+    if not any(os.path.exists(path + suffix) for suffix in ('-wal', '-journal')):
+        try:
+            return _query(path, '?mode=ro&immutable=1', query, since)
+        except sqlite3.DatabaseError as e:
+            log.debug("Immutable read of %s failed (%s); reading a snapshot instead.", path, e)
+    with tempfile.TemporaryDirectory(prefix='history-') as directory:
+        snapshot = os.path.join(directory, os.path.basename(path))
+        shutil.copyfile(path, snapshot)
+        # A hot -journal lets SQLite roll back a half-written transaction, as -wal supplies committed ones
+        for suffix in ('-wal', '-journal'):
+            if os.path.exists(path + suffix):
+                shutil.copyfile(path + suffix, snapshot + suffix)
+        return _query(snapshot, '', query, since)
+
+
+def native_history(since, browsers=None):
+    """History source for ``HistoryIngester`` reading the browsers' databases directly."""
+    for browser, profile, path in find_profiles(browsers):
+        # The mark is local wall time; each browser stores microseconds since its own epoch in UTC
+        seconds = int(since(browser, profile).timestamp())
+        if browser == 'Firefox':
+            query, threshold = FIREFOX_QUERY, seconds * 1000000
+        else:
+            query, threshold = CHROMIUM_QUERY, (seconds + WEBKIT_EPOCH_OFFSET) * 1000000
+        try:
+            rows = read_profile(path, query, threshold)
+        except (sqlite3.Error, OSError) as e:
+            log.error("Error reading %s history from %s: %s", browser, path, e)
+            continue
+        yield browser, profile, rows
+
+
+def history_source_from_env():
+    """``HISTORY_SOURCE=native`` (default) or ``library``; ``HISTORY_BROWSERS`` limits which are read."""
+    if os.getenv('HISTORY_SOURCE', 'native') == 'library':
+        return library_history
+    browsers = {name.strip().lower() for name in os.getenv('HISTORY_BROWSERS', '').split(',') if name.strip()}
+    return lambda since: native_history(since, browsers or None)
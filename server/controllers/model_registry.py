@@ -0,0 +1,167 @@
+"""In-memory registry for the failure-prediction model.
+
+The current ``(model, scaler)`` pair stays in memory between predictions.
+``publish`` writes it to a single uncompressed joblib artifact (so tree
+arrays can be memory-mapped on load) and swaps the in-memory copy
+atomically. ``get`` only goes back to disk when the artifact's mtime
+changes, e.g. after another process published a new version.
+
+``ModelStore`` keeps versioned artifacts in a GridFS bucket. The fleet
+trainer publishes to it, and registries given a store download newer
+versions from it instead of training on the agent.
+"""
+import io
+import os
+import threading
+import time
+
+import gridfs
+import joblib
+from pymongo.errors import PyMongoError
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+
+class ModelStore:
+    """Versioned model artifacts in GridFS, shared by the fleet trainer and the agents."""
+
+    def __init__(self, database, bucket='models', keep=5):
+        self.bucket = gridfs.GridFSBucket(database, bucket_name=bucket)
+        self.files = database[f'{bucket}.files']
+        self.keep = keep  # Versions kept per artifact name
+
+    def latest(self, name):
+        """The GridFS file document of the newest version of ``name``, or None."""
+        return self.files.find_one({'filename': name}, sort=[('metadata.version', -1)])
+
+    def publish(self, name, model, scaler, metadata=None):
+        """Upload a new version of ``name`` in the registry's artifact format; returns the version."""
+        latest = self.latest(name)
+        version = latest['metadata']['version'] + 1 if latest else 1
+        metadata = {**(metadata or {}), 'version': version}
+        buffer = io.BytesIO()
+        joblib.dump({'model': model, 'scaler': scaler, 'version': version, 'metadata': metadata}, buffer)
+        self.bucket.upload_from_stream(name, buffer.getvalue(), metadata=metadata)
+        for old in self.files.find({'filename': name}, {'_id': 1}).sort('metadata.version', -1).skip(self.keep):
+            self.bucket.delete(old['_id'])
+        return version
+
+    def download(self, file_document, path):
+        """Write the artifact stored as ``file_document`` to ``path`` atomically."""
+        tmp_path = f'{path}.download'
+        with open(tmp_path, 'wb') as f:
+            self.bucket.download_to_stream(file_document['_id'], f)
+        os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """Current model for one MAC address, backed by ``<mac>_model.joblib``."""
+
+    def __init__(self, mac_address, directory='.', check_interval=5.0, store=None, store_check_interval=60.0):
+        self.path = os.path.join(directory, f'{mac_address}_model.joblib')
+        self.store = store
+        # A model trained for this host wins over the fleet-wide pooled one
+        self.store_names = (f'{mac_address}_model.joblib', 'pooled_model.joblib')
+        self.store_check_interval = store_check_interval
+        self._store_checked_at = float('-inf')
+        self._store_source = None  # (name, version) last downloaded
+        self.legacy_paths = (os.path.join(directory, f'{mac_address}_model.pkl'),
+                             os.path.join(directory, f'{mac_address}_scaler.pkl'))
+        self.check_interval = check_interval
+        self._current = None  # (model, scaler, version, metadata)
+        self._loaded_stat = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        current = self._current
+        return current[2] if current else 0
+
+    @property
+    def metadata(self):
+        """What the current model was built from, e.g. its feature set and test error."""
+        current = self._current
+        return current[3] if current else {}
+
+    def publish(self, model, scaler, version=None, metadata=None):
+        """Make ``model``/``scaler`` current and persist them; returns the new version."""
+        metadata = metadata or {}
+        with self._lock:
+            version = version if version is not None else self.version + 1
+            tmp_path = f'{self.path}.tmp'
+            joblib.dump({'model': model, 'scaler': scaler, 'version': version, 'metadata': metadata}, tmp_path)
+            os.replace(tmp_path, self.path)
+            self._current = (model, scaler, version, metadata)
+            self._loaded_stat = self._stat()
+        return version
+
+    def get(self):
+        """Return ``(model, scaler)``, or None if no model has been published yet."""
+        now = time.monotonic()
+        if self.store is not None and now - self._store_checked_at >= self.store_check_interval:
+            self._store_checked_at = now
+            self._pull()
+        if self._current is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            stat = self._stat()
+            if stat is not None and stat != self._loaded_stat:
+                self._reload(stat)
+            elif stat is None and self._current is None:
+                self._migrate_legacy()
+        current = self._current
+        return (current[0], current[1]) if current else None
+
+    def load_writable(self):
+        """Load an independent, writable copy of the artifact for further training."""
+        self.get()
+        if self._stat() is None:
+            return None
+        artifact = joblib.load(self.path)
+        return artifact['model'], artifact['scaler']
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _reload(self, stat):
+        try:
+            artifact = joblib.load(self.path, mmap_mode='r')
+        except (OSError, EOFError, ValueError) as e:
+            log.error("Could not load model from %s: %s", self.path, e)
+            return
+        with self._lock:
+            self._current = (artifact['model'], artifact['scaler'], artifact.get('version', 0),
+                             artifact.get('metadata', {}))
+            self._loaded_stat = stat
+        log.info("Loaded model version %s from %s.", self.version, self.path)
+
+    def _pull(self):
+        """Download the newest published artifact for this host, if it changed."""
+        try:
+            for name in self.store_names:
+                latest = self.store.latest(name)
+                if latest is None:
+                    continue
+                source = (name, latest['metadata']['version'])
+                if source != self._store_source:
+                    self.store.download(latest, self.path)
+                    self._store_source = source
+                    self._checked_at = float('-inf')  # Reload on this call
+                    log.info("Downloaded %s version %s from the model store.", name, source[1])
+                return
+        except (PyMongoError, gridfs.errors.GridFSError, OSError) as e:
+            log.error("Could not check the model store: %s", e)
+
+    def _migrate_legacy(self):
+        """Convert the old ``<mac>_model.pkl``/``<mac>_scaler.pkl`` pair, if present."""
+        model_path, scaler_path = self.legacy_paths
+        if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
+            return
+        self.publish(joblib.load(model_path), joblib.load(scaler_path))
+        log.info("Migrated %s and %s to %s.", model_path, scaler_path, self.path)
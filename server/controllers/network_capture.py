@@ -0,0 +1,289 @@
+"""Staged packet capture pipeline for the tracking agents.
+
+The scapy ``sniff`` callback only copies the packet headers onto a bounded
+queue. A persistence thread either folds them into flows (the default) or
+turns each one into a document, and hostnames are resolved by a separate
+worker pool. Once a lookup finishes, the documents that were stored with
+``'N/A'`` are updated in place.
+
+``build_capture_filter`` keeps loopback, multicast and the agent's own
+MongoDB traffic out of the capture in the kernel, and
+``enable_headers_only_parsing`` stops scapy from dissecting payloads.
+"""
+import atexit
+import queue
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+from pymongo.uri_parser import parse_uri
+from scapy.all import conf, CookedLinux, Dot1Q, Ether, IP, TCP, UDP
+
+from agent_log import get_logger
+from agent_metrics import metrics
+from flow_table import FlowTable
+
+log = get_logger(__name__)
+
+PROTOCOL_NAMES = {1: 'ICMP', 6: 'TCP', 17: 'UDP'}
+
+# Layers scapy still dissects in headers-only mode; everything above them stays Raw
+HEADER_LAYERS = [Ether, CookedLinux, Dot1Q, IP, TCP, UDP]
+
+
+def _mongo_endpoints(mongo_url):
+    """Return ``(ip, port)`` pairs for the MongoDB servers in ``mongo_url``."""
+    endpoints = set()
+    try:
+        nodes = parse_uri(mongo_url)['nodelist']
+    except Exception as e:  # bad URI, or SRV lookup failed
+        log.warning("Could not parse MongoDB hosts for the capture filter: %s", e)
+        return endpoints
+    for host, port in nodes:
+        try:
+            for info in socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM):
+                endpoints.add((info[4][0], port))
+        except socket.gaierror:
+            continue
+    return endpoints
+
+
+def build_capture_filter(mongo_url=None, extra=None):
+    """Build the BPF expression passed to ``sniff``.
+
+    Skips loopback, multicast/broadcast and traffic to the MongoDB servers the
+    agent writes to. When the servers cannot be resolved, the MongoDB port is
+    excluded instead.
+    """
+    clauses = ['ip', 'not net 127.0.0.0/8', 'not net 224.0.0.0/4', 'not host 255.255.255.255']
+    if mongo_url:
+        endpoints = _mongo_endpoints(mongo_url)
+        if endpoints:
+            for ip_address, port in sorted(endpoints):
+                clauses.append(f'not (host {ip_address} and tcp port {port})')
+        else:
+            clauses.append('not tcp port 27017')
+    if extra:
+        clauses.append(f'({extra})')
+    return ' and '.join(clauses)
+
+
+def enable_headers_only_parsing():
+    """Limit scapy's dissection to link, IP and TCP/UDP headers for every later sniff()."""
+    conf.layers.filter(HEADER_LAYERS)
+
+
+class HostResolver:
+    """Reverse-DNS lookups on a small worker pool fed by a bounded queue."""
+
+    def __init__(self, cache, on_resolved, workers=4, max_pending=1024):
+        self.cache = cache
+        self.on_resolved = on_resolved
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f'dns-resolver-{i}', daemon=True).start()
+
+    def lookup(self, ip_address):
+        """Return the hostname if it is already known, otherwise schedule a lookup and return None."""
+        found, hostname = self.cache.get(ip_address)
+        if found:
+            return hostname
+        with self._lock:
+            if ip_address in self._pending:
+                return None
+            self._pending.add(ip_address)
+        try:
+            self._queue.put_nowait(ip_address)
+        except queue.Full:
+            # Drop the lookup rather than stall the capture; a later packet will retry it.
+            with self._lock:
+                self._pending.discard(ip_address)
+            self.skipped += 1
+        return None
+
+    def pending(self, ip_address):
+        """Whether a lookup of ``ip_address`` is queued or running."""
+        with self._lock:
+            return ip_address in self._pending
+
+    def _run(self):
+        while True:
+            ip_address = self._queue.get()
+            try:
+                hostname = socket.gethostbyaddr(ip_address)[0]
+            except (socket.herror, socket.gaierror, OSError):
+                hostname = None
+            self.cache.set(ip_address, hostname)
+            with self._lock:
+                self._pending.discard(ip_address)
+            self.on_resolved(ip_address, hostname)
+
+
+class CapturePipeline:
+    """Capture, resolution and persistence stages for ``network_requests_<mac>``.
+
+    With ``aggregate=True`` one document is written per flow instead of per packet.
+    With ``sample_rate=N`` each packet is kept with probability 1/N and flow counters are
+    scaled back up by N.
+    """
+
+    def __init__(self, collection, writer, dns_cache, resolver_workers=4, max_queue=10000,
+                 aggregate=True, idle_timeout=30, active_timeout=60, sample_rate=1, max_unresolved=4096):
+        self.collection = collection
+        self.writer = writer
+        self.resolver = HostResolver(dns_cache, self._on_resolved, workers=resolver_workers)
+        self.aggregate = aggregate
+        self.flows = FlowTable(idle_timeout=idle_timeout, active_timeout=active_timeout)
+        self._flows_lock = threading.Lock()
+        self._packets = queue.Queue(maxsize=max_queue)
+        self._unresolved = OrderedDict()  # IPs stored with 'N/A' while their lookup is pending, oldest first
+        self._unresolved_lock = threading.Lock()
+        self.max_unresolved = max_unresolved
+        self.sample_rate = max(1, int(sample_rate))
+        self.dropped = 0
+
+        metrics.register('agent_capture_queue_depth', self._packets.qsize)
+        metrics.register('agent_capture_dropped_total', lambda: self.dropped, kind='counter')
+        metrics.register('agent_capture_active_flows', lambda: len(self.flows))
+        metrics.register('agent_resolver_queue_depth', self.resolver._queue.qsize)
+        metrics.register('agent_resolver_skipped_total', lambda: self.resolver.skipped, kind='counter')
+        metrics.register('agent_dns_cache_hits_total', lambda: dns_cache.hits, kind='counter')
+        metrics.register('agent_dns_cache_misses_total', lambda: dns_cache.misses, kind='counter')
+
+        try:
+            # The backfill updates only look at documents still stored with 'N/A', so index just those
+            for field in ('source', 'destination'):
+                collection.create_index(f'{field}_ip', name=f'{field}_ip_unresolved',
+                                        partialFilterExpression={f'{field}_url': 'N/A'})
+        except PyMongoError as e:
+            log.error("Could not create network request indexes: %s", e)
+
+        threading.Thread(target=self._persist, name='capture-persist', daemon=True).start()
+        if aggregate:
+            atexit.register(self.close)
+
+    def handle_packet(self, packet):
+        """sniff() callback: copy the header fields and return immediately."""
+        if IP not in packet:
+            return
+        # Random rather than every Nth packet: a fixed stride aliases with periodic traffic such as
+        # alternating data and ACK packets, hiding one flow and doubling another
+        if self.sample_rate > 1 and random.random() >= 1 / self.sample_rate:
+            return
+        ip = packet[IP]
+        if TCP in packet:
+            src_port, dst_port = packet[TCP].sport, packet[TCP].dport
+        elif UDP in packet:
+            src_port, dst_port = packet[UDP].sport, packet[UDP].dport
+        else:
+            src_port = dst_port = None
+        try:
+            self._packets.put_nowait((time.time(), ip.proto, ip.src, src_port, ip.dst, dst_port, ip.len))
+        except queue.Full:
+            self.dropped += 1
+
+    def _persist(self):
+        next_sweep = time.time() + 1
+        while True:
+            try:
+                captured_at, proto, src_ip, src_port, dst_ip, dst_port, length = self._packets.get(timeout=1)
+            except queue.Empty:
+                pass
+            else:
+                if self.aggregate:
+                    key = (proto, src_ip, src_port, dst_ip, dst_port)
+                    with self._flows_lock:
+                        is_new = key not in self.flows
+                        evicted = self.flows.add(key, captured_at, length * self.sample_rate,
+                                                 packets=self.sample_rate)
+                    if is_new:
+                        # Warm the resolver now so the name is usually known by export time.
+                        self.resolver.lookup(src_ip)
+                        self.resolver.lookup(dst_ip)
+                    if evicted:
+                        self._export([evicted])
+                else:
+                    document = self._document(src_ip, dst_ip, captured_at)
+                    if self.sample_rate > 1:
+                        document['sample_rate'] = self.sample_rate
+                    self.writer.put(self.collection, document)
+
+            now = time.time()
+            if self.aggregate and now >= next_sweep:
+                with self._flows_lock:
+                    expired = self.flows.expire(now)
+                self._export(expired)
+                next_sweep = now + 1
+
+    def _export(self, flows):
+        documents = []
+        for (proto, src_ip, src_port, dst_ip, dst_port), flow in flows:
+            document = self._document(src_ip, dst_ip, flow.first_seen)
+            document.update({
+                'protocol': PROTOCOL_NAMES.get(proto, str(proto)),
+                'source_port': src_port,
+                'destination_port': dst_port,
+                'packets': flow.packets,
+                'bytes': flow.bytes,
+                'first_seen': datetime.fromtimestamp(flow.first_seen).strftime('%Y-%m-%d %H:%M:%S'),
+                'last_seen': datetime.fromtimestamp(flow.last_seen).strftime('%Y-%m-%d %H:%M:%S')
+            })
+            if self.sample_rate > 1:
+                document['sample_rate'] = self.sample_rate
+            documents.append(document)
+        if documents:
+            self.writer.put_many(self.collection, documents)
+
+    def _document(self, src_ip, dst_ip, captured_at):
+        src_url = self._hostname(src_ip)
+        dst_url = self._hostname(dst_ip)
+        return {
+            'timestamp': datetime.fromtimestamp(captured_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'source_ip': src_ip,
+            'source_url': src_url if src_url else 'N/A',
+            'destination_ip': dst_ip,
+            'destination_url': dst_url if dst_url else 'N/A'
+        }
+
+    def _hostname(self, ip_address):
+        # Mark the IP before looking it up so a lookup finishing in between still triggers the update.
+        with self._unresolved_lock:
+            fresh = ip_address not in self._unresolved
+            self._unresolved[ip_address] = None
+            if len(self._unresolved) > self.max_unresolved:
+                self._unresolved.popitem(last=False)  # Its 'N/A' documents are never backfilled
+        hostname = self.resolver.lookup(ip_address)
+        # Cached (positively or negatively), or the lookup was skipped: no result will come to remove it
+        if fresh and (hostname or not self.resolver.pending(ip_address)):
+            with self._unresolved_lock:
+                self._unresolved.pop(ip_address, None)
+        return hostname
+
+    def _on_resolved(self, ip_address, hostname):
+        with self._unresolved_lock:
+            if ip_address not in self._unresolved:
+                return
+            del self._unresolved[ip_address]
+        if not hostname:
+            return  # No PTR record: the 'N/A' documents stay as they are
+        # Queued behind the inserts, so the documents stored with 'N/A' already exist.
+        self.writer.put_update(self.collection,
+                               {'source_ip': ip_address, 'source_url': 'N/A'},
+                               {'$set': {'source_url': hostname}})
+        self.writer.put_update(self.collection,
+                               {'destination_ip': ip_address, 'destination_url': 'N/A'},
+                               {'$set': {'destination_url': hostname}})
+
+    def close(self):
+        """Export every open flow; registered with atexit so it runs before the writer closes."""
+        with self._flows_lock:
+            flows = self.flows.drain()
+        self._export(flows)
@@ -0,0 +1,192 @@
+"""Incremental training for the failure-prediction model.
+
+``IncrementalTrainer`` only reads the ``system_health_<mac>`` documents
+added since its last fit (tracked by ``_id``) and updates the model in
+place instead of refitting on the whole history:
+
+* ``sgd``: ``StandardScaler`` and ``SGDRegressor`` updated with ``partial_fit``.
+* ``forest``: a warm-started ``RandomForestRegressor`` that grows a few trees
+  on a sliding window of recent samples and drops its oldest trees.
+
+Features come from a shared ``FeaturePipeline``; the trainer keeps the last
+few raw rows so rolling features stay complete across update boundaries.
+Retraining is due every ``retrain_interval`` seconds, or sooner when the
+recent prediction error drifts well above the error measured at the last fit.
+"""
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.metrics import mean_absolute_error
+from sklearn.preprocessing import StandardScaler
+
+from agent_log import get_logger
+from collection_export import iter_frames
+from failure_alerts import prediction_interval
+
+log = get_logger(__name__)
+
+
+class IncrementalTrainer:
+    """Keeps a model up to date with the samples added since the previous fit."""
+
+    def __init__(self, collection, pipeline, mode='forest', window=5000, trees_per_update=10,
+                 max_trees=100, min_samples=30, retrain_interval=600, drift_factor=2.0, state_path=None):
+        if mode not in ('sgd', 'forest'):
+            raise ValueError(f"Unknown training mode: {mode}")
+        self.collection = collection
+        self.pipeline = pipeline
+        self.mode = mode
+        self.window = window
+        self.trees_per_update = trees_per_update
+        self.max_trees = max_trees
+        self.min_samples = min_samples
+        self.retrain_interval = retrain_interval
+        self.drift_factor = drift_factor
+        self.state_path = state_path
+
+        self.model = None
+        self.scaler = None
+        self.last_id = None
+        self.trained_at = 0.0
+        self.baseline_mae = None
+        self._errors = deque(maxlen=50)
+        self._window_X = np.empty((0, len(pipeline.columns)))
+        self._window_y = np.empty(0)
+        # Raw rows already trained on that later rows still need for their rolling features
+        self._tail = pipeline.raw(pd.DataFrame())
+
+    @property
+    def _context(self):
+        return self.pipeline.history + self.pipeline.horizon
+
+    def _arrays(self, frame):
+        """Features and targets for the rows of ``frame`` not trained on yet."""
+        raw = pd.concat([self._tail, self.pipeline.raw(frame)], ignore_index=True)
+        X, y = self.pipeline.training_arrays(raw, first_target=len(self._tail))
+        self._tail = raw.tail(self._context).reset_index(drop=True)
+        last_id = frame['_id'].iloc[-1] if len(frame) else None
+        return X, y, last_id
+
+    def _fetch_recent(self, count, until_id=None):
+        """The most recent ``count`` documents up to ``until_id``, oldest first."""
+        query = {'_id': {'$lte': ObjectId(until_id)}} if until_id else {}
+        projection = {field: 1 for field in self.pipeline.fields}
+        documents = list(self.collection.find(query, projection).sort('_id', -1).limit(count))
+        documents.reverse()
+        return pd.DataFrame(documents)
+
+    def _fetch_new(self):
+        Xs, ys, last_id = [], [], None
+        for frame in iter_frames(self.collection, self.pipeline.fields, after_id=self.last_id):
+            X, y, batch_last_id = self._arrays(frame)
+            Xs.append(X)
+            ys.append(y)
+            last_id = batch_last_id or last_id
+        if not Xs:
+            return np.empty((0, len(self.pipeline.columns))), np.empty(0), None
+        return np.vstack(Xs), np.concatenate(ys), last_id
+
+    def load(self, model, scaler):
+        """Resume from a saved model and the high-water mark in ``state_path``."""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, TypeError, ValueError):
+            return False
+        if state.get('mode') != self.mode or state.get('features') != self.pipeline.signature:
+            return False
+        self.model, self.scaler = model, scaler
+        self.last_id = state.get('last_id')
+        self.trained_at = state.get('trained_at', 0.0)
+        self.baseline_mae = state.get('baseline_mae')
+        # Rebuild the rolling-feature context (and for forests the training window) from trained samples
+        count = self._context + (self.window if self.mode == 'forest' else 0)
+        X, y, _ = self._arrays(self._fetch_recent(count, until_id=self.last_id))
+        if self.mode == 'forest':
+            self._window_X, self._window_y = X[-self.window:], y[-self.window:]
+        return True
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        state = {'mode': self.mode, 'features': self.pipeline.signature,
+                 'last_id': str(self.last_id) if self.last_id else None,
+                 'trained_at': self.trained_at, 'baseline_mae': self.baseline_mae}
+        with open(f'{self.state_path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
+
+    def record_error(self, actual, predicted):
+        """Feed back an observed value so drift can trigger an early retrain."""
+        self._errors.append(abs(actual - predicted))
+
+    def drifted(self):
+        if self.baseline_mae is None or len(self._errors) < 10:
+            return False
+        return np.mean(self._errors) > self.drift_factor * max(self.baseline_mae, 1.0)
+
+    def should_retrain(self):
+        return self.model is None or time.time() - self.trained_at >= self.retrain_interval or self.drifted()
+
+    def update(self):
+        """Fit on the samples added since the last update. Returns True if the model changed."""
+        if self.model is None:
+            # Until the first fit succeeds, start over from the most recent window each time
+            self._tail = self.pipeline.raw(pd.DataFrame())
+            X_new, y_new, last_id = self._arrays(self._fetch_recent(self.window + self._context))
+        else:
+            X_new, y_new, last_id = self._fetch_new()
+        if last_id is not None:
+            self.last_id = last_id
+        self.trained_at = time.time()
+        if len(y_new) == 0 or (self.model is None and len(y_new) < self.min_samples):
+            self._save_state()
+            return False
+
+        # Test-then-train: score the current model on data it has not seen yet.
+        if self.model is not None:
+            mae = mean_absolute_error(y_new, self.predict(X_new))
+            self.baseline_mae = mae if self.baseline_mae is None else 0.7 * self.baseline_mae + 0.3 * mae
+            log.info("Incremental update on %d new samples (prequential MAE %.2f).", len(y_new), mae)
+
+        if self.mode == 'sgd':
+            self._update_sgd(X_new, y_new)
+        else:
+            self._update_forest(X_new, y_new)
+        self._errors.clear()
+        self._save_state()
+        return True
+
+    def _update_sgd(self, X_new, y_new):
+        if self.model is None:
+            self.scaler = StandardScaler()
+            self.model = SGDRegressor(random_state=42)
+        self.scaler.partial_fit(X_new)
+        self.model.partial_fit(self.scaler.transform(X_new), y_new)
+
+    def _update_forest(self, X_new, y_new):
+        self._window_X = np.vstack([self._window_X, X_new])[-self.window:]
+        self._window_y = np.concatenate([self._window_y, y_new])[-self.window:]
+        if self.model is None:
+            # Trees don't need scaling; an identity scaler keeps old trees valid as data shifts.
+            self.scaler = StandardScaler(with_mean=False, with_std=False).fit(self._window_X)
+            self.model = RandomForestRegressor(n_estimators=0, warm_start=True, random_state=42)
+        self.model.n_estimators = len(getattr(self.model, 'estimators_', [])) + self.trees_per_update
+        self.model.fit(self._window_X, self._window_y)
+        if len(self.model.estimators_) > self.max_trees:
+            self.model.estimators_ = self.model.estimators_[-self.max_trees:]
+            self.model.n_estimators = len(self.model.estimators_)
+
+    def predict(self, X):
+        return self.model.predict(self.scaler.transform(X))
+
+    def predict_interval(self, X, level=0.9):
+        """``(prediction, lower, upper)`` for one row, widened by the recent prequential error."""
+        return prediction_interval(self.model, self.scaler.transform(X), self.baseline_mae, level)
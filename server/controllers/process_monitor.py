@@ -0,0 +1,225 @@
+"""Shared process-table sampler for the tracking agents.
+
+One background thread walks the process table at a fixed rate and keeps
+the attributes of every PID it has already seen, so each pass only asks
+psutil about new PIDs. Subscribers receive the PIDs that started and
+exited since the previous pass instead of scanning ``/proc`` themselves.
+
+On Linux, ``ProcConnectorMonitor`` gets the same diffs from the kernel's
+netlink proc connector as exec/exit events arrive, including the full
+command line of short-lived processes that polling would miss.
+"""
+import errno
+import os
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import psutil
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+# cmdline is filled in for exec events and for CMDLINE_NAMES; otherwise None
+ProcessInfo = namedtuple('ProcessInfo', ['pid', 'name', 'create_time', 'username', 'process', 'cmdline'],
+                         defaults=[None])
+
+# Processes whose arguments subscribers inspect, so every pass reads their cmdline
+CMDLINE_NAMES = {'git', 'git.exe'}
+
+
+class ProcessSampler:
+    """Samples the process table every ``interval`` seconds and publishes the diffs."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._known = {}  # pid -> ProcessInfo
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """Register ``callback(started, exited)``, called with lists of ``ProcessInfo``.
+
+        The first pass reports every running process as started.
+        """
+        self._subscribers.append(callback)
+
+    def snapshot(self):
+        """Return a copy of the current ``pid -> ProcessInfo`` table."""
+        with self._lock:
+            return dict(self._known)
+
+    def sample(self):
+        """Run one pass and notify subscribers; returns ``(started, exited)``."""
+        pids = set(psutil.pids())
+        with self._lock:
+            exited = [self._known.pop(pid) for pid in set(self._known) - pids]
+            started = []
+            for pid in pids - set(self._known):
+                info = self._describe(pid)
+                if info:
+                    self._known[pid] = info
+                    started.append(info)
+
+        self._publish(started, exited)
+        return started, exited
+
+    def _publish(self, started, exited):
+        if not (started or exited):
+            return
+        for callback in self._subscribers:
+            try:
+                callback(started, exited)
+            except Exception as e:
+                log.error("Process subscriber %s failed: %s", getattr(callback, '__name__', callback), e)
+
+    @staticmethod
+    def _describe(pid, with_cmdline=False):
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                name = process.name()
+                create_time = process.create_time()
+                try:
+                    username = process.username()
+                except (psutil.AccessDenied, KeyError):
+                    username = None
+                cmdline = process.cmdline() if with_cmdline or name in CMDLINE_NAMES else None
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return None
+        return ProcessInfo(pid, name, create_time, username, process, cmdline)
+
+    def start(self):
+        """Start sampling on a daemon thread."""
+        self._thread = threading.Thread(target=self._run, name='process-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        next_run = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            # Schedule from the previous deadline so slow passes don't accumulate drift.
+            next_run += self.interval
+            self._stop.wait(max(0.0, next_run - time.monotonic()))
+
+
+# Netlink proc connector constants (linux/connector.h, linux/cn_proc.h)
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HEADER = struct.Struct('=IHHII')     # len, type, flags, seq, pid
+CN_MSG_HEADER = struct.Struct('=IIIIHH')   # idx, val, seq, ack, len, flags
+PROC_EVENT_HEADER = struct.Struct('=IIQ')  # what, cpu, timestamp_ns
+PROC_EVENT_PIDS = struct.Struct('=II')     # pid, tgid (first fields of exec and exit events)
+
+
+class ProcConnectorMonitor(ProcessSampler):
+    """Event-driven ``ProcessSampler`` fed by the Linux netlink proc connector.
+
+    Needs CAP_NET_ADMIN. When the connector cannot be opened it falls back to
+    polling every ``interval`` seconds. While events are flowing, a full pass
+    still runs every ``reconcile_interval`` seconds to pick up processes that
+    forked without exec'ing and anything lost to a socket overrun.
+    """
+
+    def __init__(self, interval=1.0, reconcile_interval=30.0):
+        super().__init__(interval=interval)
+        self.reconcile_interval = reconcile_interval
+        self.backend = None
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        sock.bind((os.getpid(), CN_IDX_PROC))
+        op = struct.pack('=I', PROC_CN_MCAST_LISTEN)
+        cn_msg = CN_MSG_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(op), 0) + op
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(cn_msg), NLMSG_DONE, 0, 0, os.getpid()) + cn_msg)
+        return sock
+
+    def _run(self):
+        try:
+            sock = self._open_socket()
+        except (AttributeError, OSError) as e:  # AF_NETLINK is missing off Linux
+            log.info("Netlink proc connector unavailable (%s); falling back to /proc polling.", e)
+            self.backend = 'poll'
+            super()._run()
+            return
+
+        self.backend = 'netlink'
+        log.info("Process monitor using the netlink proc connector.")
+        sock.settimeout(1.0)
+        self.sample()
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        try:
+            while not self._stop.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    data = None
+                except OSError as e:
+                    if e.errno != errno.ENOBUFS:
+                        raise
+                    # The kernel dropped events; resync from /proc right away.
+                    data = None
+                    next_reconcile = 0
+                if data:
+                    self._handle_messages(data)
+                if time.monotonic() >= next_reconcile:
+                    self.sample()
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+        finally:
+            sock.close()
+
+    def _handle_messages(self, data):
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            msg_len = NLMSG_HEADER.unpack_from(data, offset)[0]
+            if msg_len < NLMSG_HEADER.size:
+                break
+            event_offset = offset + NLMSG_HEADER.size + CN_MSG_HEADER.size
+            if event_offset + PROC_EVENT_HEADER.size + PROC_EVENT_PIDS.size <= offset + msg_len:
+                what = PROC_EVENT_HEADER.unpack_from(data, event_offset)[0]
+                pid, tgid = PROC_EVENT_PIDS.unpack_from(data, event_offset + PROC_EVENT_HEADER.size)
+                # Ignore thread events; only the thread group leader is a process.
+                if pid == tgid:
+                    if what == PROC_EVENT_EXEC:
+                        self._on_exec(pid)
+                    elif what == PROC_EVENT_EXIT:
+                        self._on_exit(pid)
+            offset += (msg_len + 3) & ~3  # NLMSG_ALIGN
+
+    def _on_exec(self, pid):
+        # Read /proc straight away: short-lived commands are often gone within milliseconds.
+        info = self._describe(pid, with_cmdline=True)
+        if info is None:
+            return
+        with self._lock:
+            previous = self._known.get(pid)
+            self._known[pid] = info
+        # exec replaces the program image, so the old program counts as exited.
+        self._publish([info], [previous] if previous else [])
+
+    def _on_exit(self, pid):
+        with self._lock:
+            info = self._known.pop(pid, None)
+        if info:
+            self._publish([], [info])
+
+
+def create_process_monitor(backend='auto', interval=1.0):
+    """Return a process monitor for ``backend``: 'netlink', 'poll', or 'auto' (netlink on Linux)."""
+    if backend == 'netlink' or (backend == 'auto' and hasattr(socket, 'AF_NETLINK')):
+        return ProcConnectorMonitor(interval=interval)
+    return ProcessSampler(interval=interval)
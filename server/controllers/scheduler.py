@@ -0,0 +1,229 @@
+"""Config-driven scheduler for the agent's periodic collectors.
+
+Interval jobs run on a bounded thread pool. Each run is scheduled from the
+previous *scheduled* time, not from when it finished, so timing does not
+drift; missed runs are skipped rather than queued. A job never overlaps
+itself, and a run that outlives its ``timeout`` is reported (Python threads
+cannot be killed). Optional jitter spreads runs so a fleet of agents does
+not write to MongoDB in lockstep. Functions that never return, such as the
+packet capture, are ``service`` jobs: each gets its own thread and is
+restarted if it exits. ``trigger(name)`` runs an interval job as soon as
+possible outside its grid, e.g. from a filesystem event; triggers that
+arrive while the job runs are coalesced into one more run after it.
+
+The schedule comes from code defaults, overridden per job by a JSON file::
+
+    {
+      "max_workers": 4,
+      "jobs": {
+        "connected_devices": {"interval": 10, "jitter": 2, "timeout": 30},
+        "network_requests": {"service": true},
+        "browser_history": {"interval": 300, "watch": true},
+        "network_details": {"enabled": false}
+      }
+    }
+"""
+import heapq
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_log import get_logger
+from agent_metrics import metrics
+
+log = get_logger(__name__)
+
+
+def load_schedule(defaults, path=None):
+    """Merge the JSON schedule at ``path`` (if it exists) over ``defaults``, job by job."""
+    schedule = {'max_workers': defaults.get('max_workers', 4),
+                'jobs': {name: dict(job) for name, job in defaults.get('jobs', {}).items()}}
+    if not path:
+        return schedule
+    try:
+        with open(path) as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return schedule
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring schedule config %s: %s", path, e)
+        return schedule
+    schedule['max_workers'] = overrides.get('max_workers', schedule['max_workers'])
+    for name, job in overrides.get('jobs', {}).items():
+        schedule['jobs'].setdefault(name, {}).update(job)
+    return schedule
+
+
+def first_slot(now, jitter):
+    """Scheduled time of a job's first run, at a random phase so agents started together don't all fire at once."""
+    return now + random.uniform(0, jitter)
+
+
+def next_slot(scheduled, interval, now):
+    """``(next scheduled time, slots skipped)`` on the fixed grid through ``scheduled``.
+
+    Slots already past at ``now`` are skipped instead of run in a burst.
+    """
+    scheduled += interval
+    skipped = 0
+    while scheduled <= now:
+        scheduled += interval
+        skipped += 1
+    return scheduled, skipped
+
+
+def jittered(scheduled, jitter):
+    """When to actually run the slot ``scheduled``; the jitter never moves the grid itself."""
+    return scheduled + random.uniform(0, jitter)
+
+
+class Job:
+    """One scheduled function and its timing state."""
+
+    def __init__(self, name, func, interval=60.0, jitter=0.0, timeout=None, service=False, restart_delay=30.0):
+        self.name = name
+        self.func = func
+        self.interval = float(interval)
+        self.jitter = float(jitter)
+        self.timeout = timeout
+        self.service = service
+        self.restart_delay = restart_delay
+
+        self.next_run = None  # Scheduled time without jitter, on the monotonic clock
+        self.future = None
+        self.started_at = None
+        self.timed_out = False
+        self.runs = 0
+        self.skipped = 0  # Runs dropped because the previous one was still going or we fell behind
+        self.failures = 0
+        self.timeouts = 0
+
+
+class Scheduler:
+    """Runs interval jobs on a bounded pool and service jobs on their own threads."""
+
+    def __init__(self, max_workers=4, tick=0.5):
+        self.max_workers = max_workers
+        self.tick = tick
+        self.jobs = {}
+        self._heap = []
+        self._pool = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._triggered = set()
+        self._triggered_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, schedule, functions):
+        """Build a scheduler from a ``load_schedule`` result and ``{job name: callable}``."""
+        scheduler = cls(max_workers=schedule.get('max_workers', 4))
+        for name, options in schedule['jobs'].items():
+            if not options.get('enabled', True):
+                continue
+            if name not in functions:
+                log.warning("Unknown job in schedule: %s", name)
+                continue
+            # 'watch' is read by whoever wires up the filesystem triggers
+            options = {key: value for key, value in options.items() if key not in ('enabled', 'watch')}
+            scheduler.add(name, functions[name], **options)
+        return scheduler
+
+    def add(self, name, func, **options):
+        self.jobs[name] = Job(name, func, **options)
+        return self.jobs[name]
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if job.service:
+                threading.Thread(target=self._run_service, args=(job,), name=job.name, daemon=True).start()
+            else:
+                job.next_run = first_slot(now, job.jitter)
+                heapq.heappush(self._heap, (job.next_run, job.name))
+        self._thread = threading.Thread(target=self._dispatch, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=False):
+        self._stop.set()
+        if self._pool:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def trigger(self, name):
+        """Run interval job ``name`` within a tick, without moving its grid; safe from any thread."""
+        with self._triggered_lock:
+            self._triggered.add(name)
+
+    def stats(self):
+        return {name: {'runs': job.runs, 'skipped': job.skipped, 'failures': job.failures,
+                       'timeouts': job.timeouts, 'running': job.started_at is not None}
+                for name, job in self.jobs.items()}
+
+    def _dispatch(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            self._check_timeouts(now)
+            self._run_triggered()
+            while self._heap and self._heap[0][0] <= now:
+                _, name = heapq.heappop(self._heap)
+                job = self.jobs[name]
+                if job.future is not None and not job.future.done():
+                    job.skipped += 1  # Never overlap a job with itself
+                    metrics.inc('agent_job_skipped_total', job=name)
+                else:
+                    job.future = self._pool.submit(self._run, job)
+                job.next_run, skipped = next_slot(job.next_run, job.interval, now)
+                if skipped:
+                    job.skipped += skipped
+                    metrics.inc('agent_job_skipped_total', skipped, job=name)
+                heapq.heappush(self._heap, (jittered(job.next_run, job.jitter), name))
+            wait = self._heap[0][0] - time.monotonic() if self._heap else self.tick
+            self._stop.wait(min(max(wait, 0.0), self.tick))
+
+    def _run_triggered(self):
+        with self._triggered_lock:
+            triggered, self._triggered = self._triggered, set()
+        for name in triggered:
+            job = self.jobs.get(name)
+            if job is None or job.service:
+                continue
+            if job.future is not None and not job.future.done():
+                with self._triggered_lock:
+                    self._triggered.add(name)  # Run once more when the current run ends
+            else:
+                job.future = self._pool.submit(self._run, job)
+
+    def _check_timeouts(self, now):
+        for job in self.jobs.values():
+            started = job.started_at
+            if job.timeout and started is not None and not job.timed_out and now - started > job.timeout:
+                job.timed_out = True
+                job.timeouts += 1
+                metrics.inc('agent_job_timeouts_total', job=job.name)
+                log.warning("Job %s has been running for over %ss; its next runs are skipped until it finishes.",
+                            job.name, job.timeout)
+
+    def _run(self, job):
+        job.started_at, job.timed_out = time.monotonic(), False
+        status = 'ok'
+        try:
+            job.func()
+        except Exception as e:
+            job.failures += 1
+            status = 'failed'
+            log.error("Job %s failed: %s", job.name, e)
+        finally:
+            job.runs += 1
+            if not job.service:  # A service run lasts its whole lifetime, not a useful duration
+                metrics.observe('agent_job_duration_seconds', time.monotonic() - job.started_at, job=job.name)
+            metrics.inc('agent_job_runs_total', job=job.name, status=status)
+            job.started_at = None
+
+    def _run_service(self, job):
+        while not self._stop.is_set():
+            self._run(job)
+            if not self._stop.is_set():
+                log.warning("Service %s exited; restarting in %ss.", job.name, job.restart_delay)
+            self._stop.wait(job.restart_delay)
@@ -0,0 +1,5 @@
+"""The agent modules import each other as top-level modules, so put controllers/ on the path."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+
+from scheduler import Scheduler, first_slot, jittered, load_schedule, next_slot
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_next_slot_stays_on_the_grid_and_skips_missed_slots():
+    assert next_slot(10.0, 5.0, 12.0) == (15.0, 0)
+    # Slots at 15, 20, 25 and 30 are already past at 31: skipped, not run in a burst
+    assert next_slot(10.0, 5.0, 31.0) == (35.0, 4)
+
+
+def test_jitter_never_moves_the_grid():
+    for _ in range(100):
+        assert 100.0 <= first_slot(100.0, 3.0) <= 103.0
+        assert 50.0 <= jittered(50.0, 2.0) <= 52.0
+    assert first_slot(100.0, 0) == 100.0
+
+
+def test_load_schedule_merges_overrides_per_job(tmp_path):
+    path = tmp_path / 'schedule.json'
+    path.write_text(json.dumps({'max_workers': 2, 'jobs': {'a': {'interval': 5}, 'c': {'service': True}}}))
+    defaults = {'max_workers': 4, 'jobs': {'a': {'interval': 60, 'jitter': 1}, 'b': {'interval': 10}}}
+    schedule = load_schedule(defaults, str(path))
+    assert schedule['max_workers'] == 2
+    assert schedule['jobs'] == {'a': {'interval': 5, 'jitter': 1}, 'b': {'interval': 10}, 'c': {'service': True}}
+    assert defaults['jobs']['a'] == {'interval': 60, 'jitter': 1}
+    assert load_schedule(defaults, str(tmp_path / 'missing.json'))['jobs']['a']['interval'] == 60
+
+
+def test_from_config_skips_disabled_and_unknown_jobs():
+    schedule = {'jobs': {'a': {'interval': 1, 'watch': True}, 'b': {'enabled': False}, 'c': {}}}
+    scheduler = Scheduler.from_config(schedule, {'a': lambda: None, 'b': lambda: None})
+    assert list(scheduler.jobs) == ['a']
+
+
+def test_slow_job_never_overlaps_itself():
+    running, overlaps, runs = [0], [], []
+    lock = threading.Lock()
+
+    def slow():
+        with lock:
+            running[0] += 1
+            overlaps.append(running[0] > 1)
+        time.sleep(0.15)
+        with lock:
+            running[0] -= 1
+        runs.append(1)
+
+    scheduler = Scheduler(max_workers=4, tick=0.01)
+    job = scheduler.add('slow', slow, interval=0.03)
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(runs) >= 2)
+    finally:
+        scheduler.stop()
+    assert not any(overlaps)
+    assert job.skipped > 0
+
+
+def test_triggers_during_a_run_coalesce_into_one_more_run():
+    release = threading.Event()
+    started = []
+
+    def job():
+        started.append(time.monotonic())
+        release.wait(2)
+
+    scheduler = Scheduler(tick=0.01)
+    scheduler.add('job', job, interval=3600)
+    scheduler.start()
+    try:
+        assert wait_for(lambda: len(started) == 1)  # The first slot comes straight away
+        for _ in range(3):
+            scheduler.trigger('job')
+        time.sleep(0.1)
+        assert len(started) == 1
+        release.set()
+        assert wait_for(lambda: len(started) == 2)
+        time.sleep(0.1)
+        assert len(started) == 2
+    finally:
+        scheduler.stop()
+
+
+def test_failing_job_is_counted_and_keeps_its_schedule():
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError('boom')
+
+    scheduler = Scheduler(tick=0.01)
+    job = scheduler.add('broken', broken, interval=0.02)
+    scheduler.start()
+    try:
+        assert wait_for(lambda: job.failures >= 3)
+    finally:
+        scheduler.stop()
+    assert job.runs >= 3
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import usage_tracker
+from usage_tracker import UsageTracker, bucket_start, split_into_buckets
+
+DAY = 86400
+
+
+class FakeCollection:
+    def create_index(self, *args, **kwargs):
+        pass
+
+
+class FakeWriter:
+    def __init__(self):
+        self.documents = []
+        self.updates = []
+
+    def put(self, collection, document):
+        self.documents.append(document)
+
+    def put_update(self, collection, filter, update, upsert=False):
+        self.updates.append((filter, update))
+
+    def rollups(self, granularity):
+        """``{bucket: [minutes, sessions]}`` summed over the queued rollup updates."""
+        totals = {}
+        for filter, update in self.updates:
+            if filter.get('granularity') == granularity:
+                bucket = totals.setdefault(filter['bucket'], [0.0, 0])
+                bucket[0] += update['$inc']['minutes']
+                bucket[1] += update['$inc']['sessions']
+        return totals
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [datetime(2026, 3, 2, 10, 0, 30).timestamp()]
+    monkeypatch.setattr(usage_tracker.time, 'time', lambda: now[0])
+    return now
+
+
+def make_tracker(writer, **options):
+    return UsageTracker(FakeCollection(), FakeCollection(), writer, rollups_collection=FakeCollection(),
+                        **options)
+
+
+def test_split_into_buckets_covers_the_interval_exactly():
+    start, end = datetime(2026, 3, 2, 9, 59, 30), datetime(2026, 3, 2, 10, 2, 15)
+    buckets = list(split_into_buckets(start, end, 'minute'))
+    assert [bucket for bucket, _ in buckets] == [
+        datetime(2026, 3, 2, 9, 59), datetime(2026, 3, 2, 10, 0), datetime(2026, 3, 2, 10, 1),
+        datetime(2026, 3, 2, 10, 2)]
+    assert bucket_start(end, 'hour') == datetime(2026, 3, 2, 10)
+    assert sum(minutes for _, minutes in buckets) == pytest.approx((end - start).total_seconds() / 60)
+    assert buckets[0] == (datetime(2026, 3, 2, 9, 59), 0.5)
+
+
+def test_closing_an_old_session_only_rolls_up_from_tracking_start(clock):
+    writer = FakeWriter()
+    tracker = make_tracker(writer)
+    tracker.start(42, 'daemon', clock[0] - 3 * DAY)  # Running since long before the agent
+    clock[0] += 90
+    entry = tracker.end(42)
+
+    assert entry['duration_minutes'] == pytest.approx(3 * 24 * 60 + 1.5)
+    # Totals keep the whole session; rollups only cover the 90 s the agent saw
+    minutes = writer.rollups('minute')
+    assert sum(m for m, _ in minutes.values()) == pytest.approx(1.5)
+    assert len(minutes) == 2
+    assert len(writer.updates) <= 1 + 2 + 1 + 1  # totals + two minutes + one hour + one day
+
+
+def test_checkpoint_folds_keep_closes_small_and_count_each_session_once(clock):
+    writer = FakeWriter()
+    tracker = make_tracker(writer, rollup_interval=60)
+    tracker.start(7, 'editor', clock[0])
+    for _ in range(180):  # Three hours of folds, one a minute
+        clock[0] += 60
+        tracker.maybe_checkpoint()
+
+    writer.updates.clear()
+    clock[0] += 30
+    tracker.end(7)
+    assert len(writer.updates) <= 1 + 2 * 3  # totals plus at most two buckets per granularity
+
+    # Replay every fold and the close together
+    writer = FakeWriter()
+    tracker = make_tracker(writer, rollup_interval=60)
+    started = clock[0]
+    tracker.start(7, 'editor', started)
+    for _ in range(180):
+        clock[0] += 60
+        tracker.maybe_checkpoint()
+    clock[0] += 30
+    tracker.end(7)
+    for granularity in ('minute', 'hour', 'day'):
+        buckets = writer.rollups(granularity)
+        assert sum(m for m, _ in buckets.values()) == pytest.approx((clock[0] - started) / 60)
+        assert all(sessions == 1 for _, sessions in buckets.values())
+
+
+def test_restart_resumes_matching_sessions_and_closes_reused_pids(clock, tmp_path):
+    state_path = str(tmp_path / 'sessions.json')
+    writer = FakeWriter()
+    tracker = make_tracker(writer, state_path=state_path)
+    tracker.start(1, 'editor', clock[0] - 600)
+    tracker.start(2, 'player', clock[0] - 300)
+    tracker.checkpoint()
+    assert set(json.load(open(state_path))['sessions']) == {'1', '2'}
+
+    clock[0] += 120
+    restarted = make_tracker(FakeWriter(), state_path=state_path)
+    assert restarted.start(1, 'editor', clock[0] - 720) is False  # Same process: resumed
+    assert restarted.start(2, 'shell', clock[0]) is True  # PID reused by another program
+    closed = restarted.writer.documents
+    assert [entry['name'] for entry in closed] == ['player']
+    restarted.finish_restore()
+    assert restarted.end(1)['duration_minutes'] == pytest.approx(12)
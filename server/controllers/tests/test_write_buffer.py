@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+from bson.errors import InvalidDocument
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from write_buffer import BufferedWriter
+
+
+class FakeDatabase:
+    name = 'db'
+
+
+class FakeCollection:
+    """Records every bulk call; ``fail`` maps a method name to an exception raised once."""
+
+    database = FakeDatabase()
+
+    def __init__(self, name='col', fail=None):
+        self.name = name
+        self.fail = dict(fail or {})
+        self.calls = []
+        self.called = threading.Event()
+
+    def insert_many(self, documents, ordered=True):
+        self._call('insert_many', documents)
+
+    def bulk_write(self, requests, ordered=True):
+        self._call('bulk_write', requests)
+
+    def _call(self, method, argument):
+        self.calls.append((method, list(argument)))
+        self.called.set()
+        error = self.fail.pop(method, None)
+        if error is not None:
+            raise error
+
+
+def test_flush_batches_inserts_then_applies_updates():
+    collection = FakeCollection()
+    writer = BufferedWriter(batch_size=2, background=False)
+    writer.put_many(collection, [{'n': n} for n in range(3)])
+    writer.put_update(collection, {'n': 0}, {'$set': {'seen': True}})
+    writer.put(collection, {'n': 3})
+    writer.flush()
+
+    assert [method for method, _ in collection.calls] == ['insert_many', 'insert_many', 'bulk_write']
+    assert [len(argument) for _, argument in collection.calls] == [2, 2, 1]
+    # The update is applied after every document queued in the same flush, including later ones
+    assert [document['n'] for _, batch in collection.calls[:2] for document in batch] == [0, 1, 2, 3]
+    assert writer.written == 4
+    assert writer.qsize() == 0
+
+
+def test_drop_oldest_bounds_the_queue():
+    collection = FakeCollection()
+    writer = BufferedWriter(max_queue=3, background=False)
+    writer.put_many(collection, [{'n': n} for n in range(5)])
+    assert writer.dropped == 2
+    writer.flush()
+    assert [document['n'] for document in collection.calls[0][1]] == [2, 3, 4]
+
+
+def test_block_overflow_needs_a_background_flusher():
+    with pytest.raises(ValueError):
+        BufferedWriter(overflow='block', background=False)
+
+
+def test_partial_insert_failure_counts_what_was_written():
+    collection = FakeCollection(fail={'insert_many': BulkWriteError({'nInserted': 1})})
+    writer = BufferedWriter(background=False)
+    writer.put_many(collection, [{'n': 0}, {'n': 1}])
+    writer.flush()
+    assert writer.written == 1
+
+
+@pytest.mark.parametrize('error', [AutoReconnect('down'), InvalidDocument('cannot encode object')])
+def test_failed_batch_does_not_stop_the_flusher(error):
+    collection = FakeCollection(fail={'insert_many': error})
+    writer = BufferedWriter(batch_size=1, flush_interval=0.05)
+    try:
+        writer.put(collection, {'n': 0})
+        assert collection.called.wait(2)
+        collection.called.clear()
+        writer.put(collection, {'n': 1})
+        assert collection.called.wait(2)
+        assert writer._thread.is_alive()
+        deadline = time.monotonic() + 2
+        while writer.written < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert writer.written == 1
+    finally:
+        writer.close()
+
+
+def test_operations_drive_an_external_consumer():
+    collection = FakeCollection(fail={'bulk_write': AutoReconnect('down')})
+    writer = BufferedWriter(batch_size=10, background=False)
+    writer.put_many(collection, [{'n': 0}, {'n': 1}])
+    writer.put_update(collection, {}, {'$set': {'x': 1}})
+
+    for key, items in writer.take().items():
+        for method, argument, guard in writer.operations(key, items):
+            with guard:  # Swallows and logs the bulk_write failure
+                getattr(collection, method)(argument, ordered=False)
+
+    assert [method for method, _ in collection.calls] == ['insert_many', 'bulk_write']
+    assert writer.written == 2
@@ -3,8 +3,10 @@ import platform
 import socket
 import winsound
 import pywifi
-import pickle
 import time
+import queue
+import threading
+from collections import deque
 from datetime import datetime
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
@@ -12,22 +14,50 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score, mean_absolute_error
 from pymongo import MongoClient
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 # from sklearn.linear_model import LinearRegression
 from scapy.all import sniff, IP
-from browser_history import get_history
-import numpy as np
 import pandas as pd
 from dotenv import load_dotenv  # Import the dotenv module
 import os  # Import the os module to access environment variables
+from write_buffer import writer_from_env
+from agent_log import SAMPLED, setup_logging
+from agent_metrics import start_metrics_from_env
+from scheduler import Scheduler, load_schedule
+from async_agent import AsyncRuntime
+from network_capture import CapturePipeline, build_capture_filter, enable_headers_only_parsing
+from dns_cache import cache_from_env
+from history_ingest import HistoryIngester
+from history_reader import find_profiles, history_source_from_env
+from file_triggers import HISTORY_FILE_NAMES, DebouncedTrigger
+from file_audit import auditor_from_env
+from collection_export import read_frame
+from online_model import IncrementalTrainer
+from health_sampler import FIELDS, HealthSampler
+from health_features import FeaturePipeline, recent_health_frame
+from failure_alerts import AlertThrottle, AnomalyDetector, prediction_interval
+from model_registry import ModelRegistry, ModelStore
+from usage_tracker import UsageTracker, query_rollups
+from process_monitor import ProcessSampler
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Leveled, rate-limited logging configured by LOG_* variables; see agent_log.py
+log = setup_logging()
+
 # MongoDB connection
 mongo_url = os.getenv('MONGO_URL')  # Read MongoDB URI from environment variables
 client = MongoClient(mongo_url)
 
+# 'threads' runs collectors on the scheduler's thread pool; 'async' runs them on one asyncio loop
+AGENT_RUNTIME = os.getenv('AGENT_RUNTIME', 'threads')
+
+# Shared write pipeline: collectors queue documents, a background thread (or the asyncio loop) batches them
+writer = writer_from_env(background=AGENT_RUNTIME != 'async')
+
+# Reverse-DNS cache shared by the inline and pipelined capture paths
+dns_cache = cache_from_env()
+
 
 # Define system-related process names for each OS
 system_processes_windows = [
@@ -52,6 +82,9 @@ min_pid_user = 200
 
 cheating_collection = client['cheating_devices'].cheating_devices
 
+# Browser names that raise a cheating alert when a new process starts, lowercase as they are compared
+BROWSER_ALERT_NAMES = ['firefox.exe', 'msedge.exe', 'safari.exe', 'google chrome', 'firefox', 'safari', 'google-chrome', 'chromium', 'opera']
+
 def get_mac_address():
     """Automatically get the MAC address of the machine, excluding loopback and virtual interfaces."""
     for interface, addrs in psutil.net_if_addrs().items():
@@ -61,56 +94,40 @@ def get_mac_address():
                     return addr.address.replace(':', '_').upper()
     return None  # Return None if no valid MAC address is found
 
-def get_running_processes():
-    """Retrieve a list of currently running processes excluding OS and system-related processes."""
-    
-    # Detect the current operating system
+def get_system_processes():
+    """Return the system process names to ignore on the current operating system."""
     current_os = platform.system().lower()
-    
-    # Choose system process list based on the OS
     if current_os == 'windows':
-        system_processes = system_processes_windows
+        return system_processes_windows
     elif current_os in ['linux', 'fedora']:
-        system_processes = system_processes_linux
+        return system_processes_linux
     elif current_os == 'darwin':
-        system_processes = system_processes_macos
-    else:
-        system_processes = []  # For unsupported OS, no filtering
-
-    running_processes = []
-    
-    for process in psutil.process_iter(['pid', 'name', 'create_time', 'username']):
-        try:
-            # Exclude system processes by name or PID (system processes often have low PIDs)
-            if process.info['name'] not in system_processes and process.info['pid'] > min_pid_user:
-                running_processes.append((process.info['pid'], process.info['name'], process.info['create_time']))
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue  # Handle processes that may terminate during iteration
-    
-    return running_processes
-
+        return system_processes_macos
+    return []  # For unsupported OS, no filtering
 
-def detect_git_clone(mac_address):
+def detect_git_clone(mac_address, sampler):
     """Detect if any process is executing the 'git clone' command."""
-    while True:
-        for process in psutil.process_iter(['pid', 'name']):
-            try:
-                # Check if the process is 'git' and has 'clone' in its command-line arguments
-                if process.info['name'] in ['git.exe','git']:
-                    print(f"Cheating detected! Git clone command executed by PID {process.info['pid']}.")
-                    
-                    # Insert into cheating_devices collection
-                    cheating_collection.insert_one({
-                        'mac_address': mac_address,  # Replace with actual MAC address if available
-                        'type_of_cheating': 'Git clone command detected',
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
-
-                    # Optionally, terminate the process
-                    process.terminate()
-                    print(f"Terminated process with PID {process.info['pid']}.")
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
+    def on_processes_changed(started, exited):
+        for info in started:
+            # Check if the process is 'git' and has 'clone' in its command-line arguments
+            if info.name in ['git.exe','git']:
+                log.warning("Cheating detected! Git clone command executed by PID %d.", info.pid)
+
+                # Insert into cheating_devices collection
+                writer.put(cheating_collection, {
+                    'mac_address': mac_address,  # Replace with actual MAC address if available
+                    'type_of_cheating': 'Git clone command detected',
+                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                })
+
+                # Optionally, terminate the process
+                try:
+                    info.process.terminate()
+                    log.info("Terminated process with PID %d.", info.pid)
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    pass
+
+    sampler.subscribe(on_processes_changed)
 
 def play_high_volume_sound():
     """Play a high volume sound when a browser is closed."""
@@ -118,7 +135,8 @@ def play_high_volume_sound():
     duration = 1000   # Set the duration of the sound (in milliseconds)
     winsound.Beep(frequency, duration)  # Play the sound on Windows
 
-def close_all_browsers():
+def close_all_browsers(sampler):
+    """Terminate browser processes as soon as the process sampler sees them start."""
     # Define browser process names for different operating systems
     if platform.system().lower() == 'windows':
         browsers = ['firefox.exe', 'msedge.exe', 'safari.exe']  # For Windows
@@ -129,22 +147,37 @@ def close_all_browsers():
     else:
         browsers = []  # For unsupported OS, no browser processes to close
     
-    # Iterate through all running processes
-    for proc in psutil.process_iter(attrs=['pid', 'name']):
-        try:
-            if proc.info['name'] in browsers:  # Check if the process is one of the browsers
-                proc.terminate()  # Terminate the browser process
-                print(f"Terminated browser process: {proc.info['name']} (PID: {proc.info['pid']})")
-                play_high_volume_sound()
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass  # Handle processes that might terminate while we're iterating
+    # Terminating and the 1 s beep run on their own thread so the shared sampler is never held up
+    to_close = queue.Queue()
+
+    def close_browsers():
+        while True:
+            batch = [to_close.get()]
+            while not to_close.empty():
+                batch.append(to_close.get_nowait())  # A browser starts many processes at once
+            terminated = False
+            for info in batch:
+                try:
+                    info.process.terminate()  # Terminate the browser process
+                    log.info("Terminated browser process: %s (PID: %d)", info.name, info.pid)
+                    terminated = True
+                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                    pass  # Handle processes that might terminate before we get to them
+            if terminated:
+                play_high_volume_sound()  # Once per batch rather than once per process
+
+    threading.Thread(target=close_browsers, name='browser-closer', daemon=True).start()
+
+    def on_processes_changed(started, exited):
+        for info in started:
+            if info.name in browsers:  # Check if the process is one of the browsers
+                to_close.put(info)
+
+    sampler.subscribe(on_processes_changed)
 
 def resolve_ip_to_host(ip_address):
     """Resolve an IP address to a hostname."""
-    try:
-        return socket.gethostbyaddr(ip_address)[0]
-    except socket.herror:
-        return None
+    return dns_cache.resolve(ip_address)
 
 def capture_network_requests(packet, mac_address):
     """Capture network requests and store source and destination details in MongoDB."""
@@ -156,10 +189,9 @@ def capture_network_requests(packet, mac_address):
         src_url = resolve_ip_to_host(src_ip)
         dst_url = resolve_ip_to_host(dst_ip)
 
-        print(f"Network request captured:")
-        print(f"Source IP: {src_ip} ({src_url if src_url else 'N/A'})")
-        print(f"Destination IP: {dst_ip} ({dst_url if dst_url else 'N/A'})")
-        print("-" * 40)
+        # One line per packet: only logged at DEBUG, and then only a sample of them
+        log.debug("Network request captured: %s (%s) -> %s (%s)", src_ip, src_url or 'N/A',
+                  dst_ip, dst_url or 'N/A', extra=SAMPLED)
 
         # Store the network request details in MongoDB
         db = client[mac_address]
@@ -171,12 +203,39 @@ def capture_network_requests(packet, mac_address):
             'destination_ip': dst_ip,
             'destination_url': dst_url if dst_url else 'N/A'
         }
-        collection.insert_one(request_details)
+        writer.put(collection, request_details)
+
+# One capture pipeline per MAC address, reused across network_requests service restarts
+capture_pipelines = {}
 
 def start_network_capture(mac_address):
     """Start capturing network requests."""
-    print("Starting network packet capture...")
-    sniff(filter="ip", prn=lambda x: capture_network_requests(x, mac_address), store=0)
+    log.info("Starting network packet capture...")
+    # 'flows' stores one document per flow, 'pipeline' one per packet (both keep DNS lookups and DB
+    # writes out of the sniff callback), 'inline' is the old synchronous per-packet path
+    capture_mode = os.getenv('NETWORK_CAPTURE_MODE', 'flows')
+    # Filter in the kernel: CAPTURE_BPF replaces the default expression, CAPTURE_BPF_EXTRA is ANDed onto it
+    capture_filter = os.getenv('CAPTURE_BPF') or build_capture_filter(mongo_url, os.getenv('CAPTURE_BPF_EXTRA'))
+    if os.getenv('CAPTURE_HEADERS_ONLY', '1') == '1':
+        enable_headers_only_parsing()
+
+    if capture_mode == 'inline':
+        sniff(filter=capture_filter, prn=lambda x: capture_network_requests(x, mac_address), store=0)
+        return
+
+    # Built once: this service restarts whenever sniff() fails, and the pipeline's threads outlive it
+    pipeline = capture_pipelines.get(mac_address)
+    if pipeline is None:
+        collection = client[mac_address][f'network_requests_{mac_address}']
+        pipeline = capture_pipelines[mac_address] = CapturePipeline(
+            collection, writer, dns_cache,
+            resolver_workers=int(os.getenv('DNS_RESOLVER_WORKERS', 4)),
+            aggregate=capture_mode == 'flows',
+            idle_timeout=float(os.getenv('FLOW_IDLE_TIMEOUT', 30)),
+            active_timeout=float(os.getenv('FLOW_ACTIVE_TIMEOUT', 60)),
+            sample_rate=int(os.getenv('CAPTURE_SAMPLE_RATE', 1))
+        )
+    sniff(filter=capture_filter, prn=pipeline.handle_packet, store=0)
 
 
 def collect_network_details(mac_address):
@@ -205,9 +264,9 @@ def collect_network_details(mac_address):
             network_info.append(details)
 
     if network_info:
-        collection.insert_many(network_info)
+        writer.put_many(collection, network_info)
 
-    print(f"Network details updated for MAC address {mac_address}.")
+    log.info("Network details updated for MAC address %s.", mac_address)
 
 def collect_connected_devices(mac_address):
     """Collect and store connected devices details in MongoDB and handle device removal."""
@@ -295,7 +354,7 @@ def collect_connected_devices(mac_address):
             connected_devices.append(device_info)
 
     else:
-        print(f"Unsupported OS: {current_os}. Skipping Wi-Fi device collection.")
+        log.warning("Unsupported OS: %s. Skipping Wi-Fi device collection.", current_os)
 
     # Collect removable storage devices (e.g., pen drives) for all platforms
     partitions = psutil.disk_partitions()
@@ -315,31 +374,23 @@ def collect_connected_devices(mac_address):
             connected_devices.append(storage_info)
             pen_drive_detected = True
 
-    # Print connected devices details
+    # Every 10 s, so only at DEBUG; the JSON-lines sink gets the full document
     for device in connected_devices:
-        print(f"Device Type: {device['Device Type']}")
-        print(f"Device Name: {device.get('Device Name', 'N/A')}")
-        print(f"MAC Address: {device.get('MAC Address', 'N/A')}")
-        print(f"Signal Strength: {device.get('Signal Strength', 'N/A')}")
-        print(f"Mount Point: {device.get('Mount Point', 'N/A')}")
-        print(f"File System Type: {device.get('File System Type', 'N/A')}")
-        print(f"Total Size (GB): {device.get('Total Size (GB)', 'N/A')}")
-        print(f"Used Size (GB): {device.get('Used Size (GB)', 'N/A')}")
-        print(f"Free Size (GB): {device.get('Free Size (GB)', 'N/A')}")
-        print("-" * 40)
+        log.debug("Connected %s: %s", device['Device Type'], device.get('Device Name', 'N/A'),
+                  extra={'device': device})
 
     # Remove entries for devices that are no longer connected
     current_device_names = {device['Device Name'] for device in connected_devices}
     for device_name in previous_devices:
         if device_name not in current_device_names:
-            print(f"Removing device {device_name} from database.")
+            log.info("Removing device %s from database.", device_name)
             collection.delete_many({'Device Name': device_name})
 
     # Print message if a pen drive is detected
     if pen_drive_detected:
-        print("Pen drive detected.")
+        log.warning("Pen drive detected.")
         # Insert into cheating_devices collection
-        cheating_collection.insert_one({
+        writer.put(cheating_collection, {
             'mac_address': mac_address,
             'type_of_cheating': 'Pen drive detected',
             'timestamp': current_time
@@ -347,72 +398,87 @@ def collect_connected_devices(mac_address):
 
     # Store connected devices in MongoDB
     if connected_devices:
-        collection.insert_many(connected_devices)
+        writer.put_many(collection, connected_devices)
 
-    print(f"Connected devices details updated for MAC address {mac_address}.")
+    log.debug("Connected devices details updated for MAC address %s.", mac_address)
     return connected_devices, pen_drive_detected
 
 
-def collect_application_usage(mac_address):
+def collect_application_usage(mac_address, sampler):
     """Collect and store application usage data in MongoDB."""
-    print(f"Tracking MAC address: {mac_address}")
+    log.info("Tracking MAC address: %s", mac_address)
     db = client[mac_address]
     collection = db[f'process_details_{mac_address}']
-
-    # Dictionary to track start times of running processes
-    process_start_times = {}
-
-    while True:
-        running_processes = get_running_processes()
-        current_time = datetime.now()
-
-        # Track currently running processes
-        current_pids = {pid for pid, _, _ in running_processes}
-
-        # Check for processes that have ended
-        ended_pids = set(process_start_times.keys()) - current_pids
-        for pid in ended_pids:
-            start_time = process_start_times[pid]['start_time']
-            end_time = current_time
-            duration_seconds = (end_time - start_time).total_seconds()
-            duration_minutes = round(duration_seconds / 60,2)
-
-            entry = {
-                'timestamp': end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'pid': pid,
-                'name': process_start_times[pid]['name'],
-                'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'end_time': end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'duration_minutes': duration_minutes
-            }
-            collection.insert_one(entry)
-            print(f"Application {process_start_times[pid]['name']} (PID: {pid}) closed. Duration: {duration_minutes:.2f} minutes.")
-
-            # Remove the ended process from the tracking dictionary
-            del process_start_times[pid]
-
-        # Track new processes
-        for pid, name, create_time in running_processes:
-            if pid not in process_start_times:
-                start_time = datetime.fromtimestamp(create_time)
-                process_start_times[pid] = {'name': name, 'start_time': start_time}
-                print(f"New application {name} (PID: {pid}) started at {start_time}.")
-
-                # Check if the new process is a browser
-                if name.lower() in ['firefox.exe', 'msedge.exe', 'safari.exe', 'Google Chrome', 'firefox', 'safari', 'google-chrome', 'chromium', 'opera']:
-                    cheating_collection.insert_one({
-                        'mac_address': mac_address,
-                        'type_of_cheating': f'{name} opened',
-                        'timestamp': start_time.strftime('%Y-%m-%d %H:%M:%S')
-                    })
-
-        print(f"Application usage data updated for MAC address {mac_address} at {current_time}")
-
-def retrieve_application_usage(mac_address):
-    """Retrieve application usage data from MongoDB."""
+    system_processes = get_system_processes()
+
+    # Open sessions are checkpointed locally so a restart resumes them instead of losing them
+    tracker = UsageTracker(
+        collection, db[f'app_usage_totals_{mac_address}'], writer,
+        state_path=os.getenv('USAGE_STATE_PATH', f'{mac_address}_usage_sessions.json'),
+        checkpoint_interval=float(os.getenv('USAGE_CHECKPOINT_INTERVAL', 10)),
+        rollups_collection=db[f'app_usage_rollups_{mac_address}'],
+        rollup_interval=float(os.getenv('USAGE_ROLLUP_INTERVAL', 60))
+    )
+    first_pass = True
+
+    def on_processes_changed(started, exited):
+        nonlocal first_pass
+
+        # Record processes that have ended
+        for info in exited:
+            entry = tracker.end(info.pid)
+            if entry:
+                log.info("Application %s (PID: %d) closed. Duration: %.2f minutes.",
+                         entry['name'], info.pid, entry['duration_minutes'])
+
+        # Track new processes, excluding system processes by name or PID
+        for info in started:
+            if info.name in system_processes or info.pid <= min_pid_user:
+                continue
+            if not tracker.start(info.pid, info.name, info.create_time):
+                continue  # Session resumed from the checkpoint; already reported
+            start_time = datetime.fromtimestamp(info.create_time)
+            log.info("New application %s (PID: %d) started at %s.", info.name, info.pid, start_time)
+
+            # Check if the new process is a browser
+            if info.name.lower() in BROWSER_ALERT_NAMES:
+                writer.put(cheating_collection, {
+                    'mac_address': mac_address,
+                    'type_of_cheating': f'{info.name} opened',
+                    'timestamp': start_time.strftime('%Y-%m-%d %H:%M:%S')
+                })
+
+        # The first pass reports every running process, so any restored session not seen by now has ended
+        if first_pass:
+            first_pass = False
+            tracker.finish_restore()
+
+    sampler.subscribe(on_processes_changed)
+    # Checkpoints and rollup folds run on a timer: the sampler only calls back when processes change
+    tracker.start_checkpoints()
+
+def retrieve_application_usage(mac_address, start=None, end=None, granularity=None):
+    """Retrieve application usage data from MongoDB.
+
+    ``start``/``end`` are datetimes bounding the range. With ``granularity``
+    ('minute', 'hour' or 'day') per-app minutes are read from the pre-aggregated
+    rollups instead of the raw sessions.
+    """
     db = client[mac_address]
+    if granularity:
+        data = query_rollups(db[f'app_usage_rollups_{mac_address}'], granularity, start, end)
+        return pd.DataFrame(data, columns=['bucket', 'name', 'minutes', 'sessions'])
+
     collection = db[f'process_details_{mac_address}']
-    data = list(collection.find({}, {'_id': 0}))
+    query = {}
+    if start or end:
+        # Timestamps are stored as '%Y-%m-%d %H:%M:%S' strings, which sort chronologically
+        query['timestamp'] = {}
+        if start:
+            query['timestamp']['$gte'] = start.strftime('%Y-%m-%d %H:%M:%S')
+        if end:
+            query['timestamp']['$lt'] = end.strftime('%Y-%m-%d %H:%M:%S')
+    data = list(collection.find(query, {'_id': 0}))
     df = pd.DataFrame(data)
 
     # Handle missing 'name' fields
@@ -427,54 +493,63 @@ def retrieve_application_usage(mac_address):
     else:
         df['duration_minutes'].fillna(0, inplace=True)  # Replace NaN values with 0
 
-    print(df.columns)
-    print(df.head())  # Debug: Print the first few rows of the DataFrame
+    log.debug("Usage data columns: %s\n%s", list(df.columns), df.head())
     return df
 
-def collect_system_health_data():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory_info = psutil.virtual_memory()
-    disk_usage = psutil.disk_usage('/')
-    
-    return {
-        'cpu_usage': cpu_usage,
-        'memory_used': round(memory_info.used / (1024**3), 2),
-        'memory_total': round(memory_info.total / (1024**3), 2),
-        'disk_used': round(disk_usage.used / (1024**3), 2),
-        'disk_total': round(disk_usage.total / (1024**3), 2),
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-
-def collect_system_health_for_ml(mac_address):
-    db = client[mac_address]
-    collection = db[f'system_health_{mac_address}']
-    
-    health_data = collect_system_health_data()
-    collection.insert_one(health_data)
+# Fixed-cadence health sampler started by monitor_with_ml
+health_sampler = None
+# Forecast FORECAST_HORIZON_MINUTES ahead; the target is counted in stored health windows
+forecast_minutes = float(os.getenv('FORECAST_HORIZON_MINUTES', 5))
+forecast_confidence = float(os.getenv('FORECAST_CONFIDENCE', 0.9))
+alert_cpu_threshold = float(os.getenv('ALERT_CPU_THRESHOLD', 85))
+# Features shared by training and predict_failure
+feature_pipeline = FeaturePipeline(
+    horizon=max(1, round(forecast_minutes * 60 / float(os.getenv('HEALTH_WINDOW_SECONDS', 15))))
+)
+
+# One in-memory model registry per MAC address
+model_registries = {}
+
+def get_model_registry(mac_address):
+    """Return the registry holding the current model for mac_address."""
+    if mac_address not in model_registries:
+        # With TRAINING_MODE=fleet the agent only downloads models published by fleet_trainer.py
+        store = None
+        if os.getenv('TRAINING_MODE') == 'fleet':
+            store = ModelStore(client[os.getenv('FLEET_MODEL_DB', 'fleet_models')])
+        model_registries[mac_address] = ModelRegistry(mac_address, store=store)
+    return model_registries[mac_address]
+
+def save_model_artifacts(mac_address, model, scaler, mae=None):
+    """Publish the model and scaler that predict_failure uses."""
+    get_model_registry(mac_address).publish(model, scaler, metadata={
+        'features': feature_pipeline.signature,
+        'mae': mae
+    })
+
+# One alert throttle per MAC address, so repeated alerts are suppressed
+alert_throttles = {}
+
+def get_alert_throttle(mac_address):
+    """Return the throttle that writes to failure_alerts_<mac_address>."""
+    if mac_address not in alert_throttles:
+        alert_throttles[mac_address] = AlertThrottle(
+            writer, client[mac_address][f'failure_alerts_{mac_address}'],
+            cooldown=float(os.getenv('ALERT_COOLDOWN', 900)),
+            confirmations=int(os.getenv('ALERT_CONFIRMATIONS', 3))
+        )
+    return alert_throttles[mac_address]
 
 def train_predictive_model(mac_address):
     db = client[mac_address]
     collection = db[f'system_health_{mac_address}']
     
-    data = list(collection.find())
-    if len(data) < 30:  # More data for better accuracy
-        print("Not enough data to train the model.")
+    # Stream only the needed fields in cursor batches instead of materialising every document
+    data = read_frame(collection, fields=feature_pipeline.fields)
+    X, y = feature_pipeline.training_arrays(feature_pipeline.raw(data))
+    if len(y) < 30:  # More data for better accuracy
+        log.info("Not enough data to train the model.")
         return None
-    
-    X = []
-    y = []
-    for record in data:
-        features = [
-            record['memory_used'], 
-            record['memory_total'], 
-            record['disk_used'], 
-            record['disk_total']
-        ]
-        X.append(features)
-        y.append(record['cpu_usage'])
-
-    X = np.array(X)
-    y = np.array(y)
 
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
@@ -487,24 +562,20 @@ def train_predictive_model(mac_address):
     # model1 = LinearRegression()
     # model1.fit(X_train, y_train)
 
-    # Save model and scaler for reuse
-    with open(f'{mac_address}_model.pkl', 'wb') as f:
-        pickle.dump(model, f)
-    with open(f'{mac_address}_scaler.pkl', 'wb') as f:
-        pickle.dump(scaler, f)
-
     train_score = r2_score(y_train, model.predict(X_train))
     test_score = r2_score(y_test, model.predict(X_test))
 
     train_mae = mean_absolute_error(y_train, model.predict(X_train))
     test_mae = mean_absolute_error(y_test, model.predict(X_test))
 
+    # Save model and scaler for reuse; the test error sizes the forecast intervals
+    save_model_artifacts(mac_address, model, scaler, test_mae)
+
     # train_mae_lr = mean_absolute_error(y_train, model1.predict(X_train))
     # test_mae_lr = mean_absolute_error(y_test, model1.predict(X_test))
 
-    print("Random Forest Regression")
-    print(f"Training R2: {train_score:.2f}, Test R2: {test_score:.2f}")
-    print(f"Training MAE: {train_mae:.2f}, Test MAE: {test_mae:.2f}")
+    log.info("Random Forest Regression: training R2 %.2f, test R2 %.2f; training MAE %.2f, test MAE %.2f",
+             train_score, test_score, train_mae, test_mae)
 
     # print("Linear Regression")
     # print(f"Training MAE: {train_mae_lr:.2f}, Test MAE: {test_mae_lr:.2f}")
@@ -512,48 +583,135 @@ def train_predictive_model(mac_address):
     return model, scaler
 
 def predict_failure(mac_address):
-    try:
-        with open(f'{mac_address}_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        with open(f'{mac_address}_scaler.pkl', 'rb') as f:
-            scaler = pickle.load(f)
-    except FileNotFoundError:
-        print("Model not found. Training the model now...")
+    # The registry keeps the model in memory and only reloads when the artifact on disk changes
+    registry = get_model_registry(mac_address)
+    current = registry.get()
+    if current and registry.metadata.get('features') == feature_pipeline.signature:
+        model, scaler = current
+    elif registry.store is not None:
+        log.info("Waiting for the fleet trainer to publish a model for these features.")
+        return None
+    else:
+        log.info("Model not found or built for other features. Training the model now...")
         result = train_predictive_model(mac_address)
         if result is None:
-            print("Training failed. Not enough data.")
-            return
+            log.warning("Training failed. Not enough data.")
+            return None
         model, scaler = result
 
-    health_data = collect_system_health_data()
-    X_new = np.array([[health_data['memory_used'], health_data['memory_total'], health_data['disk_used'], health_data['disk_total']]])
+    collection = client[mac_address][f'system_health_{mac_address}']
+    frame = recent_health_frame(feature_pipeline, health_sampler, collection)
+    X_new = feature_pipeline.latest(frame)
+    if X_new is None:
+        log.info("Not enough recent health data to predict yet.")
+        return None
     X_new_scaled = scaler.transform(X_new)
 
-    prediction = model.predict(X_new_scaled)[0]
-
-    print(f"Predicted CPU usage: {prediction:.2f}%")
-
-    if prediction > 5:
-        db = client[mac_address]
-        alert_collection = db[f'failure_alerts_{mac_address}']
-        alert_collection.insert_one({
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'predicted_cpu_usage': prediction,
-            'alert': 'High CPU usage predicted. Reduce the number of applications you are using.'
-        })
-        print(f"⚠️ Alert: High CPU usage predicted ({prediction:.2f}%)!")
-
+    prediction, lower, upper = prediction_interval(model, X_new_scaled, registry.metadata.get('mae'),
+                                                   forecast_confidence)
+
+    log.info("Predicted CPU usage in %g min: %.2f%% (%.0f%% interval %.2f-%.2f%%)",
+             forecast_minutes, prediction, forecast_confidence * 100, lower, upper)
+
+    alerted = get_alert_throttle(mac_address).observe('forecast', prediction > alert_cpu_threshold, {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'type': 'forecast',
+        'predicted_cpu_usage': prediction,
+        'lower': lower,
+        'upper': upper,
+        'horizon_minutes': forecast_minutes,
+        'alert': 'High CPU usage predicted. Reduce the number of applications you are using.'
+    })
+    if alerted:
+        log.warning("⚠️ Alert: High CPU usage predicted (%.2f%%)!", prediction)
+
+    # The newest window mean is what a forecast made horizon minutes ago was aiming at
+    return prediction, float(frame['cpu_usage'].iloc[-1])
+
+def check_health_anomalies(mac_address, predicted_cpu_usage=None):
+    """Alert on readings far above their recent baseline in the health ring buffer."""
+    if health_sampler is None:
+        return
+    found = anomaly_detector.check(*health_sampler.recent())
+    anomalies = {field: (value, zscore) for field, value, zscore in found}
+    if predicted_cpu_usage is None and found:
+        predicted_cpu_usage = health_sampler.latest()['cpu_usage']
+    throttle = get_alert_throttle(mac_address)
+    for field in anomaly_detector.watch:
+        document = None
+        if field in anomalies:
+            value, zscore = anomalies[field]
+            document = {
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'type': 'anomaly',
+                'field': field,
+                'value': round(value, 2),
+                'zscore': round(zscore, 2),
+                'predicted_cpu_usage': predicted_cpu_usage,
+                'alert': f'Unusually high {field} compared with the last {anomaly_detector.baseline_seconds / 60:g} minutes.'
+            }
+        if throttle.observe(f'anomaly:{field}', field in anomalies, document):
+            log.warning("⚠️ Alert: Unusual %s (%s, z-score %s)!", field, document['value'], document['zscore'])
+
+
+def start_health_sampler(mac_address):
+    """Sample system health in the background and store one downsampled document per window."""
+    global health_sampler
+    if health_sampler is not None:
+        return  # Already sampling; monitor_with_ml restarts must not start a second writer of the same windows
+    collection = client[mac_address][f'system_health_{mac_address}']
+    health_sampler = HealthSampler(
+        interval=float(os.getenv('HEALTH_SAMPLE_INTERVAL', 1)),
+        window=float(os.getenv('HEALTH_WINDOW_SECONDS', 15)),
+        on_window=lambda summary: writer.put(collection, summary)
+    )
+    health_sampler.start()
+
+# Robust z-score detector over the sampler's ring buffer
+anomaly_detector = AnomalyDetector(
+    FIELDS,
+    baseline_seconds=float(os.getenv('ANOMALY_BASELINE_SECONDS', 600)),
+    threshold=float(os.getenv('ANOMALY_ZSCORE', 4))
+)
 
 def monitor_with_ml(mac_address):
+    # 'forest' and 'sgd' update the model with new samples only; 'full' refits from scratch on a schedule;
+    # 'fleet' never trains here and scores with the models fleet_trainer.py publishes
+    training_mode = os.getenv('TRAINING_MODE', 'forest')
+    retrain_interval = float(os.getenv('RETRAIN_INTERVAL', 600))  # Seconds between scheduled retrains
+    trainer = None
+    if training_mode not in ('full', 'fleet'):
+        trainer = IncrementalTrainer(
+            client[mac_address][f'system_health_{mac_address}'], feature_pipeline,
+            mode=training_mode, retrain_interval=retrain_interval,
+            state_path=f'{mac_address}_train_state.json'
+        )
+        # Memory-mapped arrays are read-only, so resume training from a writable copy
+        current = get_model_registry(mac_address).load_writable()
+        if current:
+            trainer.load(*current)
+
+    start_health_sampler(mac_address)
+
+    last_full_fit = 0
+    pending = deque()  # (due time, forecast) waiting for the value they predicted
     while True:
-        collect_system_health_for_ml(mac_address)
-        current_time = int(time.time())
-
-        # Retrain model periodically
-        if current_time % 6 == 0:  # Every 10 minutes
+        # Retrain on schedule, or early when predictions drift away from what we measure
+        if trainer:
+            if trainer.should_retrain() and trainer.update():
+                save_model_artifacts(mac_address, trainer.model, trainer.scaler, trainer.baseline_mae)
+        elif training_mode == 'full' and time.time() - last_full_fit >= retrain_interval:
             train_predictive_model(mac_address)
-
-        predict_failure(mac_address)
+            last_full_fit = time.time()
+
+        result = predict_failure(mac_address)
+        if trainer and result:
+            prediction, actual_cpu = result
+            now = time.time()
+            while pending and pending[0][0] <= now:
+                trainer.record_error(actual_cpu, pending.popleft()[1])
+            pending.append((now + forecast_minutes * 60, prediction))
+        check_health_anomalies(mac_address, result[0] if result else None)
         time.sleep(5)
 
 
@@ -657,165 +815,88 @@ def monitor_with_ml(mac_address):
 #             predict_failure(mac_address, model)
 
 
-def retrieve_browser_history(mac_address):
-    """Retrieve and store browser history details in MongoDB."""
-    start_time = datetime.now()
-    date_only = start_time.strftime('%Y-%m-%d')
-    db = client[mac_address]
-    collection = db[f'browser_history_{mac_address}']
-
-    print("Starting browser history retrieval...")
-
-    # Get the browser history
-    try:
-        history = get_history()  # Assuming get_history is defined elsewhere
-        print("Retrieved browser history.")
-    except Exception as e:
-        print(f"Error retrieving browser history: {e}")
-        return
-
-    if not history:
-        print("No browser history found.")
-        return
-
-    history_data = history.histories
-
-    if not history_data:
-        print("No browser history data found.")
-        return
+# One ingester per MAC address, keeping the per-browser high-water marks between runs
+history_ingesters = {}
 
-    entries = []
-
-    # Function to validate entries (e.g., check for valid URL)
-    def is_valid_entry(entry):
-        """Check if the entry is valid."""
-        if isinstance(entry, tuple) and len(entry) >= 2:
-            timestamp, url, title = entry[:3]  # Extract only the first two elements (timestamp, url)
-            # Check if the URL is valid
-            if not isinstance(url, str) or not url.startswith('http'):
-                return False
-            return True
-        return False
-
-    # Iterate through the history data and filter out invalid entries
-    for entry in history_data:
-        if is_valid_entry(entry):
-            timestamp, url, title = entry[:3]  # Extract the timestamp and url
-            # Convert timestamp to a string in the desired format
-            timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            timestamp_dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            timestamp_date_only = timestamp_dt.strftime('%Y-%m-%d')
-            if timestamp_date_only >= date_only:
-                entry_data = {
-                    'timestamp': timestamp_str,
-                    'url': url,
-                    'title': title
-                }
-                print(f"Adding entry: {entry_data}")
-                entries.append(entry_data)
-
-    # Sort entries by timestamp in decreasing order
-    entries.sort(key=lambda x: x['timestamp'], reverse=True)
-
-    # Insert only valid entries into the collection
-    if entries:
-        try:
-            result = collection.insert_many(entries)
-            print(f"Inserted {len(entries)} entries into the database.")
-        except Exception as e:
-            print(f"Error inserting entries into the database: {e}")
-            return
-
-    # Check if collection exists after insertion
-    if collection.count_documents({}) > 0:
-        print("Browser history data successfully stored.")
-        return
-    else:
-        print("No browser history data stored.")
+def retrieve_browser_history(mac_address):
+    """Store the browser history visited since the previous run in MongoDB."""
+    if mac_address not in history_ingesters:
+        history_ingesters[mac_address] = HistoryIngester(
+            client[mac_address][f'browser_history_{mac_address}'], writer,
+            read_history=history_source_from_env())
+    added = history_ingesters[mac_address].run()
+    if added:
+        log.info("Inserted %d entries into the database.", added)
+
+def watch_browser_history(observer, schedule, runner):
+    """Trigger the browser_history job when a browser profile's history files change."""
+    options = schedule['jobs'].get('browser_history', {})
+    if not options.get('watch') or not options.get('enabled', True):
         return
-
-
-class FileChangeHandler(FileSystemEventHandler):
-    """Handle file system events."""
-    def on_modified(self, event):
-        if not event.is_directory:
-            print(f"File modified: {event.src_path}")
-
-    def on_created(self, event):
-        if not event.is_directory:
-            print(f"File created: {event.src_path}")
-
-    def on_deleted(self, event):
-        if not event.is_directory:
-            print(f"File deleted: {event.src_path}")
+    trigger = DebouncedTrigger(lambda: runner.trigger('browser_history'), names=HISTORY_FILE_NAMES,
+                               debounce=float(os.getenv('HISTORY_DEBOUNCE', 2)),
+                               max_delay=float(os.getenv('HISTORY_MAX_DELAY', 10)), name='history-trigger')
+    directories = [os.path.dirname(path) for _, _, path in find_profiles()]
+    log.info("Watching %d browser profiles for history changes.", trigger.watch(observer, directories))
+
+# Seconds between runs of each collector; 'service' jobs never return and are restarted if they do
+DEFAULT_SCHEDULE = {
+    'max_workers': 3,
+    'jobs': {
+        # 'watch': also run when a browser writes its history; the interval is only a safety net
+        'browser_history': {'interval': 300, 'jitter': 30, 'timeout': 120, 'watch': True},
+        'network_details': {'interval': 300, 'jitter': 30, 'timeout': 120},
+        'connected_devices': {'interval': 10, 'jitter': 2, 'timeout': 60},
+        'machine_learning': {'service': True, 'restart_delay': 300},
+        'network_requests': {'service': True, 'restart_delay': 300}
+    }
+}
 
 if __name__ == "__main__":
     mac_address = input("Enter the MAC address to track: ")
     # mac_address = get_mac_address()
     
-    # Start monitoring in separate threads
-    import threading
-
-    def monitor_network_details():
-        while True:
-            collect_network_details(mac_address)
-            time.sleep(300)  # Check every 5 minutes
-
-    def monitor_connected_devices():
-        while True:
-            collect_connected_devices(mac_address)
-            time.sleep(10)  # Check every 5 minutes
+    # One process-table sampler feeds usage tracking, browser policing and git detection
+    process_sampler = ProcessSampler(interval=float(os.getenv('PROCESS_SAMPLE_INTERVAL', 1)))
+    collect_application_usage(mac_address, process_sampler)
+    close_all_browsers(process_sampler)
+    detect_git_clone(mac_address, process_sampler)
+    process_sampler.start()
 
-    def monitor_application_usage():
-        while True:
-            collect_application_usage(mac_address)
-            time.sleep(10)
-
-    def monitor_machine_learning():
-        while True:
-            monitor_with_ml(mac_address)
-            time.sleep(300)
-
-    def monitor_network_requests():
-        while True:
-            start_network_capture(mac_address)
-            time.sleep(300)
+    # Agent self-metrics: METRICS_PORT serves Prometheus text, summaries go to agent_metrics_<mac>
+    start_metrics_from_env(writer, client[mac_address][f'agent_metrics_{mac_address}'])
 
-    def monitor_browser_history():
-        while True:
-            retrieve_browser_history(mac_address)
-            time.sleep(10)
-
-    def monitor_all_browsers():
-        while True:
-            close_all_browsers()
-            time.sleep(10)
-
-    def monitor_git_clone():
-        while True:
-            detect_git_clone(mac_address)
-            time.sleep(5)  # Check every 5 seconds
-
-    # Start threads for monitoring
-    threading.Thread(target=monitor_browser_history, daemon=True).start()
-    threading.Thread(target=monitor_network_details, daemon=True).start()
-    threading.Thread(target=monitor_connected_devices, daemon=True).start()
-    threading.Thread(target=monitor_application_usage, daemon=True).start()
-    threading.Thread(target=monitor_machine_learning, daemon=True).start()
-    threading.Thread(target=monitor_network_requests, daemon=True).start()
-    threading.Thread(target=monitor_all_browsers, daemon=True).start()
-    threading.Thread(target=monitor_git_clone, daemon=True).start()
-
-    # Set up file system monitoring
-    path_to_watch = "."  # Monitor the current directory
-    event_handler = FileChangeHandler()
+    # Set up file system monitoring: FILE_AUDIT_PATHS, summarized per path into file_activity_<mac>
     observer = Observer()
-    observer.schedule(event_handler, path_to_watch, recursive=True)
+    auditor_from_env(client[mac_address][f'file_activity_{mac_address}'], writer).start(observer)
     observer.start()
 
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
\ No newline at end of file
+    # SCHEDULE_CONFIG overrides DEFAULT_SCHEDULE job by job
+    schedule = load_schedule(DEFAULT_SCHEDULE, os.getenv('SCHEDULE_CONFIG', 'schedule.json'))
+    functions = {
+        'browser_history': lambda: retrieve_browser_history(mac_address),
+        'network_details': lambda: collect_network_details(mac_address),
+        'connected_devices': lambda: collect_connected_devices(mac_address),
+        'machine_learning': lambda: monitor_with_ml(mac_address),
+        'network_requests': lambda: start_network_capture(mac_address),
+    }
+
+    if AGENT_RUNTIME == 'async':
+        # One event loop runs every collector until SIGINT/SIGTERM, then flushes pending writes
+        runtime = AsyncRuntime(schedule, writer, mongo_url)
+        watch_browser_history(observer, schedule, runtime)
+        runtime.run(functions)
+    else:
+        scheduler = Scheduler.from_config(schedule, functions)
+        scheduler.start()
+        watch_browser_history(observer, schedule, scheduler)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        scheduler.stop()
+
+    observer.stop()
+    observer.join()
+    writer.close()
\ No newline at end of file
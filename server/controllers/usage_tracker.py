@@ -0,0 +1,235 @@
+"""Application-usage sessions that survive agent restarts.
+
+``UsageTracker`` keeps the open sessions (``pid -> name, create_time``)
+and checkpoints them to a small JSON file, so a restarted agent resumes
+them instead of starting over. A session is only resumed when the PID's
+``create_time`` still matches; otherwise the PID was reused and the old
+session is closed. Every closed session also increments a per-app totals
+document, so readers never have to sum raw sessions.
+
+Per-app minute/hour/day rollups are kept current incrementally: every
+``rollup_interval`` the time open sessions ran since the last fold is
+added to their buckets, so closing even a days-old session only flushes
+its last few minutes. Rollups start when tracking began, never at a
+process's much older ``create_time``.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import PyMongoError
+
+from agent_log import get_logger
+
+log = get_logger(__name__)
+
+ROLLUP_GRANULARITIES = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1)
+}
+
+
+def bucket_start(moment, granularity):
+    """Truncate ``moment`` (local time) to the start of its ``granularity`` bucket."""
+    if granularity == 'minute':
+        return moment.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def split_into_buckets(start, end, granularity):
+    """Yield ``(bucket_start, minutes)`` for every bucket the interval ``[start, end)`` overlaps."""
+    step = ROLLUP_GRANULARITIES[granularity]
+    bucket = bucket_start(start, granularity)
+    while bucket < end:
+        bucket_end = bucket + step
+        overlap = (min(end, bucket_end) - max(start, bucket)).total_seconds()
+        if overlap > 0:
+            yield bucket, overlap / 60
+        bucket = bucket_end
+
+
+def query_rollups(collection, granularity, start=None, end=None, names=None):
+    """Read rollup buckets in ``[start, end)``, filtering and projecting on the server."""
+    query = {'granularity': granularity}
+    bucket_range = {}
+    if start is not None:
+        bucket_range['$gte'] = bucket_start(start, granularity).strftime('%Y-%m-%d %H:%M:%S')
+    if end is not None:
+        bucket_range['$lt'] = end.strftime('%Y-%m-%d %H:%M:%S')
+    if bucket_range:
+        query['bucket'] = bucket_range
+    if names:
+        query['name'] = {'$in': list(names)}
+    return list(collection.find(query, {'_id': 0, 'bucket': 1, 'name': 1, 'minutes': 1, 'sessions': 1}).sort('bucket', 1))
+
+
+class UsageTracker:
+    """Open application sessions for one MAC address, checkpointed to ``state_path``."""
+
+    def __init__(self, collection, totals_collection, writer, state_path=None, checkpoint_interval=10,
+                 rollups_collection=None, rollup_interval=60):
+        self.collection = collection
+        self.totals_collection = totals_collection
+        self.rollups_collection = rollups_collection
+        self.writer = writer
+        self.state_path = state_path
+        self.checkpoint_interval = checkpoint_interval
+        self.rollup_interval = rollup_interval
+
+        self._sessions = {}  # pid -> {'name', 'create_time', 'rolled_until'}
+        self._restored = {}  # sessions loaded from disk and not yet seen running
+        self._restored_at = None  # checkpoint time of the restored sessions
+        self._checkpointed_at = time.time()
+        self._tracking_since = self._checkpointed_at
+        self._rolled_at = self._checkpointed_at
+        self._lock = threading.Lock()
+
+        try:
+            totals_collection.create_index('name', unique=True)
+            if rollups_collection is not None:
+                rollups_collection.create_index([('granularity', 1), ('bucket', 1), ('name', 1)], unique=True)
+        except PyMongoError as e:
+            log.error("Could not create usage indexes: %s", e)
+
+        if state_path:
+            self._load()
+            atexit.register(self.checkpoint)
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._restored_at = saved.get('checkpointed_at', time.time())
+        self._restored = {int(pid): session for pid, session in saved.get('sessions', {}).items()}
+        log.info("Restored %d open application sessions from %s.", len(self._restored), self.state_path)
+
+    def start(self, pid, name, create_time):
+        """Track a running process. Returns False when an existing session was resumed."""
+        with self._lock:
+            restored = self._restored.pop(pid, None)
+            if restored and restored['name'] == name and abs(restored['create_time'] - create_time) < 1:
+                self._sessions[pid] = restored
+                return False
+            if restored:
+                # Same PID, different process: the restored one ended while the agent was down.
+                self._close_session(pid, restored, self._restored_at)
+            self._sessions[pid] = {'name': name, 'create_time': create_time}
+            return True
+
+    def end(self, pid, end_time=None):
+        """Close the session for ``pid``; returns the stored entry, or None if it wasn't tracked."""
+        with self._lock:
+            session = self._sessions.pop(pid, None)
+            if session is None:
+                return None
+            return self._close_session(pid, session, end_time or time.time())
+
+    def finish_restore(self):
+        """Close restored sessions whose process is gone; call after the first full process pass."""
+        with self._lock:
+            restored, self._restored = self._restored, {}
+            for pid, session in restored.items():
+                self._close_session(pid, session, self._restored_at)
+
+    def _close_session(self, pid, session, end_time):
+        start_time = datetime.fromtimestamp(session['create_time'])
+        end = datetime.fromtimestamp(end_time)
+        duration_minutes = round((end - start_time).total_seconds() / 60, 2)
+        entry = {
+            'timestamp': end.strftime('%Y-%m-%d %H:%M:%S'),
+            'pid': pid,
+            'name': session['name'],
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': end.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_minutes': duration_minutes
+        }
+        self.writer.put(self.collection, entry)
+        self.writer.put_update(self.totals_collection, {'name': session['name']}, {
+            '$inc': {'total_minutes': duration_minutes, 'sessions': 1},
+            '$set': {'last_seen': entry['end_time']}
+        }, upsert=True)
+        self._fold_rollups(session, end_time)
+        return entry
+
+    def _fold_rollups(self, session, until):
+        """Add the time ``session`` ran since its last fold, up to ``until``, to its rollup buckets.
+
+        A session counts once per bucket: only in the fold that first reaches into it.
+        """
+        if self.rollups_collection is None:
+            return
+        first_fold = 'rolled_until' not in session
+        # Time before tracking began (boot daemons, restarts without a checkpoint) is never rolled up
+        since = session.get('rolled_until') or max(session['create_time'], self._tracking_since)
+        if until <= since:
+            return
+        start, end = datetime.fromtimestamp(since), datetime.fromtimestamp(until)
+        for granularity in ROLLUP_GRANULARITIES:
+            for bucket, minutes in split_into_buckets(start, end, granularity):
+                counted = 1 if first_fold or bucket >= start else 0
+                self.writer.put_update(self.rollups_collection, {
+                    'granularity': granularity,
+                    'bucket': bucket.strftime('%Y-%m-%d %H:%M:%S'),
+                    'name': session['name']
+                }, {'$inc': {'minutes': round(minutes, 4), 'sessions': counted}}, upsert=True)
+        session['rolled_until'] = until
+
+    def start_checkpoints(self):
+        """Call ``maybe_checkpoint`` on a timer thread, independent of process start/exit events.
+
+        The checkpoint time doubles as the end time of sessions that close while
+        the agent is down, so it must be refreshed even on an idle machine.
+        """
+        threading.Thread(target=self._run_checkpoints, name='usage-checkpoints', daemon=True).start()
+
+    def _run_checkpoints(self):
+        while True:
+            time.sleep(min(self.checkpoint_interval, self.rollup_interval))
+            try:
+                self.maybe_checkpoint()
+            except Exception as e:
+                log.error("Error checkpointing application sessions: %s", e)
+
+    def maybe_checkpoint(self):
+        """Checkpoint once ``checkpoint_interval`` seconds have passed, folding rollups every ``rollup_interval``."""
+        now = time.time()
+        if now - self._rolled_at >= self.rollup_interval:
+            self.fold_rollups()
+        if now - self._checkpointed_at >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def fold_rollups(self):
+        """Bring every open session's rollups up to now."""
+        with self._lock:
+            now = time.time()
+            for session in self._sessions.values():
+                self._fold_rollups(session, now)
+            self._rolled_at = now
+
+    def checkpoint(self):
+        """Write the open sessions, with how far each is rolled up, to ``state_path`` atomically."""
+        if not self.state_path:
+            return
+        with self._lock:
+            now = time.time()
+            # Sessions restored but not yet matched are still open as far as we know.
+            sessions = {**self._restored, **self._sessions}
+            state = {'checkpointed_at': now, 'sessions': {str(pid): s for pid, s in sessions.items()}}
+            self._checkpointed_at = now
+        tmp_path = f'{self.state_path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            log.error("Error saving application sessions to %s: %s", self.state_path, e)
@@ -0,0 +1,193 @@
+"""Buffered MongoDB writer shared by the tracking agents.
+
+Collectors hand documents to a ``BufferedWriter`` instead of calling
+``insert_one`` themselves. A single background thread groups the queued
+documents by target collection and writes them with ``insert_many``.
+Updates queued with ``put_update`` are applied after the inserts of the
+same flush, so they always see documents queued before them. With
+``background=False`` no thread is started and the owner drains the queue
+with ``take()``, e.g. from an asyncio task writing through Motor, and
+performs the calls listed by ``operations()``.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from agent_log import get_logger
+from agent_metrics import SIZE_BUCKETS, collection_label, metrics
+
+log = get_logger(__name__)
+
+
+class BufferedWriter:
+    """Bounded in-process write queue flushed with ``insert_many(ordered=False)``."""
+
+    def __init__(self, batch_size=500, flush_interval=2.0, max_queue=50000, overflow='drop_oldest',
+                 background=True):
+        if overflow not in ('block', 'drop_oldest'):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if overflow == 'block' and not background:
+            # The queue's owner may itself be the producer that blocks, e.g. a coroutine on the draining loop
+            raise ValueError("overflow='block' needs the background flusher; use 'drop_oldest'")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+
+        self._queue = deque()
+        self._collections = {}  # (db name, collection name) -> Collection
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.dropped = 0
+        self.written = 0
+        metrics.register('agent_write_queue_depth', self.qsize)
+        metrics.register('agent_write_dropped_total', lambda: self.dropped, kind='counter')
+        metrics.register('agent_write_documents_total', lambda: self.written, kind='counter')
+
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name='buffered-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, collection, document):
+        """Queue a single document for ``collection``. Never waits on the network."""
+        self.put_many(collection, [document])
+
+    def put_many(self, collection, documents):
+        """Queue several documents for ``collection``."""
+        key = (collection.database.name, collection.name)
+        documents = list(documents)
+        metrics.inc('agent_items_queued_total', len(documents), collection=collection_label(*key))
+        with self._lock:
+            if self._closed:
+                # After shutdown there is no flusher left, so write directly.
+                self._write(key, collection, documents)
+                return
+            self._collections[key] = collection
+            for document in documents:
+                if len(self._queue) >= self.max_queue:
+                    if self.overflow == 'drop_oldest':
+                        self._queue.popleft()
+                        self.dropped += 1
+                    else:
+                        self._wake.set()
+                        while len(self._queue) >= self.max_queue and not self._closed:
+                            self._not_full.wait()
+                self._queue.append((key, document))
+            if len(self._queue) >= self.batch_size:
+                self._wake.set()
+
+    def put_update(self, collection, filter, update, upsert=False):
+        """Queue an ``update_many`` to run after every document already queued."""
+        self.put_many(collection, [UpdateMany(filter, update, upsert=upsert)])
+
+    def qsize(self):
+        return len(self._queue)
+
+    def take(self):
+        """Remove everything queued and return it as ``{(db name, collection name): items}``."""
+        with self._lock:
+            pending = list(self._queue)
+            self._queue.clear()
+            self._not_full.notify_all()
+        grouped = {}
+        for key, document in pending:
+            grouped.setdefault(key, []).append(document)
+        return grouped
+
+    def flush(self):
+        """Write everything currently queued, grouped by collection."""
+        for key, documents in self.take().items():
+            self._write(key, self._collections[key], documents)
+
+    def operations(self, key, items):
+        """Yield ``(method, argument, guard)`` for every bulk call that writes ``items`` taken for ``key``.
+
+        The caller runs ``collection.<method>(argument, ordered=False)`` inside
+        ``with guard:``, awaiting it on a Motor collection. The guard times the
+        call, counts what was written and logs any failure instead of raising.
+        Inserts come first, in ``batch_size`` batches, then every update.
+        """
+        documents = [item for item in items if not isinstance(item, UpdateMany)]
+        updates = [item for item in items if isinstance(item, UpdateMany)]
+        label = collection_label(*key)
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            metrics.observe('agent_db_batch_size', len(batch), buckets=SIZE_BUCKETS, collection=label)
+            yield 'insert_many', batch, self._guard(key, 'insert_many', batch)
+        if updates:
+            yield 'bulk_write', updates, self._guard(key, 'bulk_write', updates)
+
+    @contextmanager
+    def _guard(self, key, op, items):
+        try:
+            with metrics.time('agent_db_write_seconds', op=op, collection=collection_label(*key)):
+                yield
+            if op == 'insert_many':
+                self.written += len(items)
+        except PyMongoError as e:
+            if op == 'bulk_write':
+                log.error("Error applying %d updates to %s.%s: %s", len(items), key[0], key[1], e)
+            elif isinstance(e, BulkWriteError):
+                inserted = e.details.get('nInserted', 0)
+                self.written += inserted
+                log.error("Bulk write to %s.%s partially failed: %d documents rejected.", key[0], key[1],
+                          len(items) - inserted)
+            else:
+                log.error("Error writing %d documents to %s.%s: %s", len(items), key[0], key[1], e)
+        except Exception as e:
+            # e.g. bson.errors.InvalidDocument for a value BSON can't encode; drop the batch, keep flushing
+            log.error("Error writing %d %s to %s.%s: %s", len(items),
+                      'updates' if op == 'bulk_write' else 'documents', key[0], key[1], e)
+
+    def _write(self, key, collection, items):
+        for method, argument, guard in self.operations(key, items):
+            with guard:
+                getattr(collection, method)(argument, ordered=False)
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while not self._closed:
+            self._wake.wait(timeout=max(0.0, deadline - time.monotonic()))
+            self._wake.clear()
+            if self._closed:
+                break
+            if len(self._queue) >= self.batch_size or time.monotonic() >= deadline:
+                try:
+                    self.flush()
+                except Exception as e:  # Never let one bad flush stop the only flusher
+                    log.error("Flushing the write queue failed: %s", e)
+                deadline = time.monotonic() + self.flush_interval
+
+    def close(self):
+        """Stop the background thread and flush whatever is still queued."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._not_full.notify_all()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+def writer_from_env(background=True):
+    """Build a ``BufferedWriter`` configured from ``WRITE_*`` environment variables."""
+    return BufferedWriter(
+        batch_size=int(os.getenv('WRITE_BATCH_SIZE', 500)),
+        flush_interval=float(os.getenv('WRITE_FLUSH_INTERVAL', 2.0)),
+        max_queue=int(os.getenv('WRITE_MAX_QUEUE', 50000)),
+        overflow=os.getenv('WRITE_OVERFLOW', 'drop_oldest'),
+        background=background,
+    )